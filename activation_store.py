@@ -0,0 +1,213 @@
+"""
+Disk-backed store of residual stream activations.
+
+Residuals are keyed by (model id, layer, text hash). Tensors are appended to
+flat bf16 (or fp16) shard files and located through a SQLite index; reads
+memory-map the shard and return a view, so nothing is copied into RAM and
+the model is never loaded for texts that are already stored. Several
+processes can share a store: each append holds an exclusive lock on its
+shard (fcntl, where available) from finding the end of the file to
+indexing the bytes it wrote.
+
+    store = ActivationStore("cache/activations")
+    acts = store.activations(texts, [9, 20])   # extracts only what is missing
+    acts.max_pool(20, encoder.encode)
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from functools import partial
+
+import numpy as np
+import torch
+
+from activations import BATCH_SIZE, ActivationCollector, Activations
+from models import MODEL_NAME, get_model, get_tokenizer
+
+STORE_DIR = os.getenv("ACTIVATION_STORE", "cache/activations")
+SHARD_BYTES = 256 * 1024 * 1024
+DTYPES = {"bfloat16": torch.bfloat16, "float16": torch.float16}
+
+_activation_store = None
+
+
+def text_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+@contextmanager
+def _exclusive(f):
+    """Hold an exclusive lock on an open file against other processes (a no-op without fcntl)."""
+    try:
+        import fcntl
+    except ImportError:  # Windows
+        yield
+        return
+    fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+    try:
+        yield
+    finally:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+class ActivationStore:
+    """Append-only residual shards under `root`, indexed by (model, layer, text hash)."""
+
+    def __init__(self, root=STORE_DIR, dtype="bfloat16", shard_bytes=SHARD_BYTES):
+        self.root = root
+        self.dtype = dtype
+        self.shard_bytes = shard_bytes
+        self.lock = threading.Lock()
+        self.maps = {}  # shard -> read-only memmap of its bytes
+        os.makedirs(root, exist_ok=True)
+
+        self.conn = sqlite3.connect(os.path.join(root, "index.sqlite"), check_same_thread=False, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS residuals (
+                model TEXT NOT NULL,
+                layer INTEGER NOT NULL,
+                text_hash TEXT NOT NULL,
+                dtype TEXT NOT NULL,
+                shard TEXT NOT NULL,
+                offset INTEGER NOT NULL,
+                seq_len INTEGER NOT NULL,
+                hidden INTEGER NOT NULL,
+                PRIMARY KEY (model, layer, text_hash)
+            )"""
+        )
+        self.conn.commit()
+        shards = sorted(name for name in os.listdir(root) if name.endswith(".bin"))
+        self.shard = shards[-1] if shards else "shard_00000.bin"
+
+    def _path(self, shard):
+        return os.path.join(self.root, shard)
+
+    def has(self, model, layer, text):
+        with self.lock:
+            return self.conn.execute(
+                "SELECT 1 FROM residuals WHERE model = ? AND layer = ? AND text_hash = ?",
+                (model, layer, text_hash(text)),
+            ).fetchone() is not None
+
+    def put(self, model, layer, text, resid):
+        """Append a [seq_len, hidden] residual (stored in the store's dtype)."""
+        tensor = resid.detach().to("cpu", DTYPES[self.dtype]).contiguous()
+        data = tensor.view(torch.int16).numpy().tobytes()
+        with self.lock:
+            while True:
+                with open(self._path(self.shard), "ab") as f, _exclusive(f):
+                    # The end as of holding the lock: another process may have appended since open
+                    offset = f.seek(0, os.SEEK_END)
+                    if not offset or offset + len(data) <= self.shard_bytes:
+                        # Data before index: a crash leaves unreferenced bytes, never a dangling entry
+                        f.write(data)
+                        f.flush()
+                        self.conn.execute(
+                            "INSERT OR REPLACE INTO residuals VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                            (model, layer, text_hash(text), self.dtype, self.shard, offset, *tensor.shape),
+                        )
+                        self.conn.commit()
+                        return
+                self.shard = f"shard_{int(self.shard[6:11]) + 1:05d}.bin"
+
+    def get(self, model, layer, text):
+        """[seq_len, hidden] residual as a zero-copy view of its shard, or None."""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT dtype, shard, offset, seq_len, hidden FROM residuals "
+                "WHERE model = ? AND layer = ? AND text_hash = ?",
+                (model, layer, text_hash(text)),
+            ).fetchone()
+            if row is None:
+                return None
+            dtype, shard, offset, seq_len, hidden = row
+            end = offset + 2 * seq_len * hidden
+            data = self.maps.get(shard)
+            if data is None or len(data) < end:
+                # Shards only grow, so a map is reopened once it is too short
+                data = self.maps[shard] = np.memmap(self._path(shard), dtype=np.uint8, mode="c")
+        return torch.from_numpy(data[offset:end]).view(DTYPES[dtype]).view(seq_len, hidden)
+
+    def missing(self, texts, layers, model=MODEL_NAME):
+        """The texts (deduplicated, in order) not yet stored at every one of `layers`."""
+        return [text for text in dict.fromkeys(texts) if not all(self.has(model, layer, text) for layer in layers)]
+
+    def put_activations(self, model, acts):
+        """Store every residual of an Activations batch that is not stored yet."""
+        for layer, residuals in acts.residuals.items():
+            for text, resid in zip(acts.texts, residuals):
+                if not self.has(model, layer, text):
+                    self.put(model, layer, text, resid)
+
+    def read(self, texts, layers, model=MODEL_NAME):
+        """Activations of texts that are all stored, as zero-copy views."""
+        return Activations(texts, {layer: [self.get(model, layer, text) for text in texts] for layer in layers})
+
+    def activations(self, texts, layers, model=MODEL_NAME):
+        """Activations for `texts` at `layers`, extracting and storing only what is missing.
+
+        Missing texts go through ActivationCollector.map, so writing one batch
+        to the shards overlaps the forward pass of the next.
+        """
+        texts = list(dict.fromkeys(texts))
+        missing = self.missing(texts, layers, model)
+        if missing:
+            collector = ActivationCollector(get_model(model), get_tokenizer(model), layers)
+            for _ in collector.map(missing, partial(self.put_activations, model)):
+                pass
+        return self.read(texts, layers, model)
+
+
+def get_activation_store():
+    """Shared ActivationStore, opened on first use. None when the store is disabled."""
+    global _activation_store
+    if _activation_store is None and STORE_DIR:
+        _activation_store = ActivationStore(STORE_DIR)
+    return _activation_store
+
+
+def collect_activations(texts, layers, model=MODEL_NAME):
+    """Residual streams of `texts` at every layer in `layers`.
+
+    Served from the shared store when it is enabled (only missing texts go
+    through the model), otherwise from one batched pass.
+    """
+    store = get_activation_store()
+    if store is not None:
+        return store.activations(texts, layers, model)
+    return ActivationCollector(get_model(model), get_tokenizer(model), layers).collect(texts)
+
+
+def map_activations(texts, layers, fn, model=MODEL_NAME, batch_size=BATCH_SIZE):
+    """Yield fn(Activations) over batches of `texts`.
+
+    With the store enabled, texts already stored are read from it first, without
+    loading the model. Every other text goes through ActivationCollector.map,
+    which overlaps fn with the next forward pass, and is stored from the fn
+    workers on the way. Stored batches come before extracted ones, so callers
+    should key results by Activations.texts rather than rely on input order.
+    """
+    texts = list(dict.fromkeys(texts))
+    store = get_activation_store()
+    missing = texts
+    if store is not None:
+        missing = store.missing(texts, layers, model)
+        pending = set(missing)
+        stored = [text for text in texts if text not in pending]
+        for start in range(0, len(stored), batch_size):
+            yield fn(store.read(stored[start:start + batch_size], layers, model))
+    if not missing:
+        return
+
+    def store_then(acts):
+        # fn sees the stored (rounded) residuals, so results match a warm store exactly
+        store.put_activations(model, acts)
+        return fn(store.read(acts.texts, layers, model))
+
+    collector = ActivationCollector(get_model(model), get_tokenizer(model), layers, batch_size)
+    yield from collector.map(missing, fn if store is None else store_then)
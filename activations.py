@@ -0,0 +1,174 @@
+"""
+Batched residual stream collection over several layers in one forward pass.
+
+ActivationCollector hooks every requested layer at once and runs texts
+through the model in right-padded batches. Padding is stripped with the
+attention mask before anything is returned, so last-token and max-pooled
+views only ever see real tokens, and both come from the same pass.
+
+By default the pass is truncated: it runs the decoder stack only (no LM head
+and no logits) and stops as soon as the deepest hooked layer has produced
+its output, so collecting L20 of a 42-layer model costs about half a pass.
+
+ActivationCollector.map pipelines extraction with downstream work: while a
+worker pool encodes batch i through an SAE, the model already runs batch
+i + 1.
+"""
+
+import queue
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+
+from models import layer_hidden_states
+from profiling import stage
+
+BATCH_SIZE = 16
+# ActivationCollector.map: encode threads and batches staged at once
+ENCODE_WORKERS = 2
+MAX_PENDING = 3
+
+
+class StopForward(Exception):
+    """Raised from the deepest hook to end a truncated forward pass."""
+
+
+class Activations:
+    """Residual streams of a list of texts, per hooked layer, without padding."""
+
+    def __init__(self, texts, residuals):
+        self.texts = texts
+        self.residuals = residuals  # layer -> list of [seq_len, hidden] CPU tensors
+        self.index = {text: i for i, text in enumerate(texts)}
+
+    def tokens(self, layer, text):
+        """[seq_len, hidden] residual stream of one text."""
+        return self.residuals[layer][self.index[text]]
+
+    def last_token(self, layer):
+        """[n_texts, hidden] residual at each text's last real token."""
+        return torch.stack([resid[-1] for resid in self.residuals[layer]])
+
+    def max_pool(self, layer, encode=None):
+        """[n_texts, dim] max over each text's tokens, of encode(resid) if given (e.g. an SAE)."""
+        pooled = []
+        with torch.no_grad():
+            for resid in self.residuals[layer]:
+                values = encode(resid) if encode is not None else resid
+                pooled.append(values.max(dim=0).values)
+        return torch.stack(pooled)
+
+
+class ActivationCollector:
+    """Collect residual streams at the output of `layers` for batches of texts."""
+
+    def __init__(self, model, tokenizer, layers, batch_size=BATCH_SIZE, truncate=True):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.layers = sorted(set(layers))
+        self.batch_size = batch_size
+        self.truncate = truncate
+
+    def _forward(self, inputs):
+        with torch.no_grad():
+            if not self.truncate:
+                self.model(**inputs)
+                return
+            try:
+                # The decoder stack without the LM head, cut short after the deepest layer
+                self.model.model(**inputs, use_cache=False)
+            except StopForward:
+                pass
+
+    def batches(self, texts):
+        """Yield (batch texts, real lengths, {layer: [batch, seq, hidden] on the model device})."""
+        captured = {}
+
+        def make_hook(layer):
+            def hook(module, input, output):
+                with stage("hook_capture"):
+                    captured[layer] = layer_hidden_states(output).detach()
+                if self.truncate and layer == self.layers[-1]:
+                    raise StopForward
+            return hook
+
+        handles = [self.model.model.layers[layer].register_forward_hook(make_hook(layer))
+                   for layer in self.layers]
+        tokenizer = self.tokenizer
+        # Right padding keeps the real tokens at the positions they have unbatched
+        padding_side, tokenizer.padding_side = tokenizer.padding_side, "right"
+        try:
+            for start in range(0, len(texts), self.batch_size):
+                batch = texts[start:start + self.batch_size]
+                with stage("tokenize"):
+                    inputs = tokenizer(batch, return_tensors="pt", padding=True).to(self.model.device)
+                with stage("forward"):
+                    self._forward(inputs)
+                lengths = inputs["attention_mask"].sum(dim=1).tolist()
+                yield batch, lengths, {layer: captured.pop(layer) for layer in self.layers}
+        finally:
+            tokenizer.padding_side = padding_side
+            for handle in handles:
+                handle.remove()
+
+    def collect(self, texts):
+        """Run every text once and return its Activations (duplicate texts run once)."""
+        texts = list(dict.fromkeys(texts))
+        residuals = {layer: [] for layer in self.layers}
+        for _, lengths, hidden in self.batches(texts):
+            for layer in self.layers:
+                with stage("device_to_host"):
+                    layer_hidden = hidden[layer].cpu()
+                with stage("upcast"):
+                    layer_hidden = layer_hidden.float()
+                residuals[layer].extend(layer_hidden[i, :length] for i, length in enumerate(lengths))
+        return Activations(texts, residuals)
+
+    def map(self, texts, fn, workers=ENCODE_WORKERS, max_pending=MAX_PENDING):
+        """Yield fn(Activations of each batch), in order, overlapping fn with the next forward pass.
+
+        The forward pass runs on the calling thread and fn (e.g. an SAE encode)
+        on a pool of `workers` threads. Residuals are staged in a fixed set of
+        `max_pending` reused (pinned, on CUDA) host buffers: when all are in
+        use, the next forward waits, which bounds memory. The Activations
+        handed to fn are views into a buffer, valid only during the call, so
+        fn must return new tensors (pooled values, encodings), not views.
+        """
+        texts = list(dict.fromkeys(texts))
+        free = queue.Queue()
+        for _ in range(max_pending):
+            free.put({})
+        pin = torch.cuda.is_available() and self.model.device.type == "cuda"
+
+        def run(batch, lengths, buffers, copied):
+            try:
+                if copied is not None:
+                    copied.synchronize()
+                residuals = {layer: [buffers[layer][i, :length] for i, length in enumerate(lengths)]
+                             for layer in self.layers}
+                with stage("map_fn"):
+                    return fn(Activations(batch, residuals))
+            finally:
+                free.put(buffers)
+
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for batch, lengths, hidden in self.batches(texts):
+                with stage("wait_for_buffer"):
+                    buffers = free.get()  # backpressure: blocks while max_pending batches are in flight
+                for layer, h in hidden.items():
+                    buffer = buffers.get(layer)
+                    if buffer is None or buffer.dtype != h.dtype or any(a < b for a, b in zip(buffer.shape, h.shape)):
+                        buffer = buffers[layer] = torch.empty(h.shape, dtype=h.dtype, pin_memory=pin)
+                    with stage("device_to_host"):
+                        buffer[:h.shape[0], :h.shape[1]].copy_(h, non_blocking=pin)
+                copied = None
+                if pin:
+                    copied = torch.cuda.Event()
+                    copied.record()
+                pending.append(pool.submit(run, batch, lengths, buffers, copied))
+                while pending and pending[0].done():
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
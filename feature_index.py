@@ -0,0 +1,232 @@
+"""
+Sparse index of top-k SAE feature activations over prompt corpora.
+
+Each token of each indexed prompt keeps its k strongest SAE features, in a
+CSR layout of flat arrays appended to files in one directory:
+
+  indptr.i64    token row r owns entries indptr[r]:indptr[r + 1]
+  features.i32  feature id of each entry
+  values.f16    activation of each entry
+  tokens.i32    token id of each row
+  docs.i64      prompt d owns token rows docs[d]:docs[d + 1]
+  meta.json     model, layer, k, the prompts and their categories, and the
+                committed length of every array
+
+Arrays are memory-mapped for queries. New prompt categories are appended in
+place; meta.json is rewritten last, so a crash mid-append leaves the index
+as it was.
+
+    mats-feature-index --feature 80603          # max-activating prompts and tokens
+    mats-feature-index --prompt "The first person to walk on Mars was"
+"""
+
+import os
+import json
+import argparse
+
+import numpy as np
+
+from models import MODEL_NAME, SAE_WIDTH
+from profiling import profiled
+
+# --- CONFIGURATION ---
+INDEX_DIR = "cache/feature_index"
+LAYER = 20
+TOP_K = 32
+
+ARRAYS = {"indptr": np.int64, "features": np.int32, "values": np.float16, "tokens": np.int32, "docs": np.int64}
+EXTENSIONS = {"indptr": "i64", "features": "i32", "values": "f16", "tokens": "i32", "docs": "i64"}
+
+
+class FeatureIndex:
+    """Top-k SAE activations per token for a growing set of prompts."""
+
+    def __init__(self, path, layer=LAYER, k=TOP_K, model=MODEL_NAME, width=SAE_WIDTH):
+        self.path = path
+        meta_path = os.path.join(path, "meta.json")
+        if os.path.exists(meta_path):
+            with open(meta_path, encoding="utf-8") as f:
+                self.meta = json.load(f)
+            if (self.meta["model"], self.meta["layer"], self.meta["width"]) != (model, layer, width):
+                raise ValueError(f"{path} indexes {self.meta['model']} layer {self.meta['layer']} "
+                                 f"width {self.meta['width']}, not {model} layer {layer} width {width}")
+        else:
+            os.makedirs(path, exist_ok=True)
+            self.meta = {
+                "model": model, "layer": layer, "width": width, "k": k,
+                "texts": [], "categories": [], "lengths": {name: 0 for name in ARRAYS},
+            }
+            # CSR offsets start at 0
+            self._append({"indptr": np.zeros(1, np.int64), "docs": np.zeros(1, np.int64)})
+        self.text_ids = {text: i for i, text in enumerate(self.meta["texts"])}
+        self._arrays = None
+        self._by_feature = None
+
+    def __len__(self):
+        return len(self.meta["texts"])
+
+    def _file(self, name):
+        return os.path.join(self.path, f"{name}.{EXTENSIONS[name]}")
+
+    def _append(self, arrays):
+        """Append to the array files after their committed lengths, then commit the new lengths."""
+        lengths = dict(self.meta["lengths"])
+        for name, values in arrays.items():
+            dtype = np.dtype(ARRAYS[name])
+            with open(self._file(name), "ab") as f:
+                # Drop anything written past the last commit by an interrupted append
+                f.truncate(lengths[name] * dtype.itemsize)
+                f.write(np.ascontiguousarray(values, dtype=dtype).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            lengths[name] += len(values)
+
+        self.meta["lengths"] = lengths
+        tmp_path = os.path.join(self.path, "meta.json.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.meta, f)
+        os.replace(tmp_path, os.path.join(self.path, "meta.json"))
+        self._arrays = self._by_feature = None
+
+    @property
+    def arrays(self):
+        """Memory-mapped views of the committed arrays."""
+        if self._arrays is None:
+            self._arrays = {
+                name: np.memmap(self._file(name), dtype=dtype, mode="r", shape=(self.meta["lengths"][name],))
+                if self.meta["lengths"][name] else np.zeros(0, dtype)
+                for name, dtype in ARRAYS.items()
+            }
+        return self._arrays
+
+    def add(self, texts, category=None):
+        """Index the texts not indexed yet; returns how many were added."""
+        new = [text for text in dict.fromkeys(texts) if text not in self.text_ids]
+        if not new:
+            return 0
+
+        from activation_store import collect_activations
+        from models import get_sae_weights, get_tokenizer
+        from sae_encoders import SparseEncoder
+
+        layer = self.meta["layer"]
+        acts = collect_activations(new, [layer], self.meta["model"])
+        encoder = SparseEncoder(get_sae_weights(layer, self.meta["width"]), top_k=self.meta["k"])
+        tokenizer = get_tokenizer(self.meta["model"])
+
+        counts, features, values, tokens, doc_rows = [], [], [], [], []
+        for text in new:
+            resid = acts.tokens(layer, text)
+            token_ids = tokenizer(text)["input_ids"]
+            assert len(token_ids) == resid.shape[0], "tokenization does not match the stored residuals"
+            encoded = encoder.encode(resid)
+            counts.append(encoded.crow_indices().diff().numpy())
+            features.append(encoded.col_indices().numpy())
+            values.append(encoded.values().numpy())
+            tokens.extend(token_ids)
+            doc_rows.append(len(token_ids))
+
+        nnz, rows = int(self.arrays["indptr"][-1]), len(self.arrays["tokens"])
+        self.meta["texts"].extend(new)
+        self.meta["categories"].extend([category] * len(new))
+        self._append({
+            "indptr": nnz + np.cumsum(np.concatenate(counts)),
+            "features": np.concatenate(features),
+            "values": np.concatenate(values),
+            "tokens": np.array(tokens),
+            "docs": rows + np.cumsum(doc_rows),
+        })
+        self.text_ids = {text: i for i, text in enumerate(self.meta["texts"])}
+        return len(new)
+
+    def _entries(self, feature):
+        """Entry positions holding `feature`, via a by-feature sort built once per commit."""
+        if self._by_feature is None:
+            order = np.argsort(self.arrays["features"], kind="stable")
+            self._by_feature = (order, self.arrays["features"][order])
+        order, sorted_features = self._by_feature
+        lo, hi = np.searchsorted(sorted_features, [feature, feature + 1])
+        return order[lo:hi]
+
+    def _rows(self, entries):
+        return np.searchsorted(self.arrays["indptr"], entries, side="right") - 1
+
+    def _docs(self, rows):
+        return np.searchsorted(self.arrays["docs"], rows, side="right") - 1
+
+    def top_prompts(self, feature, n=10):
+        """[(text, category, max activation)] of the prompts where `feature` fires most."""
+        entries = self._entries(feature)
+        if not len(entries):
+            return []
+        best = np.full(len(self), -np.inf, dtype=np.float32)
+        np.maximum.at(best, self._docs(self._rows(entries)), self.arrays["values"][entries].astype(np.float32))
+        order = [d for d in np.argsort(-best)[:n] if best[d] > -np.inf]
+        return [(self.meta["texts"][d], self.meta["categories"][d], float(best[d])) for d in order]
+
+    def top_tokens(self, feature, n=10):
+        """[(text, token position, token id, activation)] of the strongest tokens for `feature`."""
+        entries = self._entries(feature)
+        values = self.arrays["values"][entries].astype(np.float32)
+        top = entries[np.argsort(-values, kind="stable")[:n]]
+        rows = self._rows(top)
+        docs = self._docs(rows)
+        return [
+            (self.meta["texts"][d], int(r - self.arrays["docs"][d]), int(self.arrays["tokens"][r]),
+             float(self.arrays["values"][e]))
+            for e, r, d in zip(top, rows, docs)
+        ]
+
+    def top_features(self, text, n=10):
+        """[(feature, max activation over the prompt's tokens)] strongest first."""
+        d = self.text_ids[text]
+        a = self.arrays
+        lo, hi = a["indptr"][a["docs"][d]], a["indptr"][a["docs"][d + 1]]
+        features, inverse = np.unique(a["features"][lo:hi], return_inverse=True)
+        best = np.full(len(features), -np.inf, dtype=np.float32)
+        np.maximum.at(best, inverse, a["values"][lo:hi].astype(np.float32))
+        order = np.argsort(-best)[:n]
+        return [(int(features[i]), float(best[i])) for i in order]
+
+
+@profiled("feature_index")
+def main():
+    from prompts import confabulation_prompts
+
+    parser = argparse.ArgumentParser(description="Index top-k SAE activations over the prompt corpus and query it.")
+    parser.add_argument("--layer", type=int, default=LAYER)
+    parser.add_argument("--k", type=int, default=TOP_K, help="features kept per token")
+    parser.add_argument("--feature", type=int, action="append", default=[], help="show where a feature fires most")
+    parser.add_argument("--prompt", action="append", default=[], help="show a prompt's strongest features")
+    parser.add_argument("-n", type=int, default=10, help="results per query")
+    args = parser.parse_args()
+
+    index = FeatureIndex(f"{INDEX_DIR}/layer_{args.layer}", layer=args.layer, k=args.k)
+    for category, texts in confabulation_prompts.items():
+        added = index.add(texts, category)
+        if added:
+            print(f"Indexed {added} prompts from {category}")
+    print(f"{len(index)} prompts, {len(index.arrays['tokens'])} tokens, {len(index.arrays['features'])} entries")
+
+    if args.feature or args.prompt:
+        from models import get_tokenizer
+        tokenizer = get_tokenizer(index.meta["model"])
+
+    for feature in args.feature:
+        print(f"\n>>> FEATURE {feature}: top prompts")
+        for text, category, value in index.top_prompts(feature, args.n):
+            print(f"  {value:8.2f} | [{category}] {text}")
+        print(f">>> FEATURE {feature}: top tokens")
+        for text, position, token_id, value in index.top_tokens(feature, args.n):
+            print(f"  {value:8.2f} | {tokenizer.decode([token_id])!r} @ {position} | {text}")
+
+    for text in args.prompt:
+        if text not in index.text_ids:
+            index.add([text], "cli")
+        print(f"\n>>> PROMPT: {text}")
+        for feature, value in index.top_features(text, args.n):
+            print(f"  {value:8.2f} | {feature}")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,12 +2,7 @@
 Difference in Means: Validate Feature 107788 is a "Truth" feature
 """
 
-import torch
-import numpy as np
-from scipy import stats
-from tqdm import tqdm
-from transformers import AutoModelForCausalLM, AutoTokenizer
-from sae_lens.saes.sae import SAE
+from profiling import profiled
 
 FEATURE_IDX_L9 = 80216  # L9 Uncertainty
 FEATURE_IDX_L20 = 107788  # L20 Truth
@@ -18,26 +13,6 @@ FEATURE_IDX_L20 = 107788  # L20 Truth
 FEATURE_IDX_L9 = 122482
 FEATURE_IDX_L20 = 80603
 
-# Load model
-print("Loading model...")
-model = AutoModelForCausalLM.from_pretrained(
-    "google/gemma-2-9b-it",
-    torch_dtype=torch.bfloat16,
-    device_map="auto",
-)
-model.eval()
-tokenizer = AutoTokenizer.from_pretrained("google/gemma-2-9b-it")
-print(f"Model loaded: {torch.cuda.memory_allocated() / 1e9:.2f} GB")
-
-# Load SAE on CPU to save GPU memory
-print("Loading L20 SAE on CPU...")
-sae_l20, cfg, sparsity = SAE.from_pretrained(
-    release="gemma-scope-9b-it-res-canonical",  # IT = instruction-tuned
-    sae_id="layer_20/width_131k/canonical",  # Also different SAE variant
-    device="cpu"
-)
-print("SAE loaded on CPU")
-
 # True/False pairs (matched structure)
 pairs = [
     ("The capital of France is Paris", "The capital of France is Berlin"),
@@ -62,163 +37,183 @@ pairs = [
     ("Sound needs a medium to travel", "Sound travels through vacuum"),
 ]
 
-def get_max_feature_activation(text, layer, feature_idx):
-    """Get MAX activation of a feature across all token positions."""
-    inputs = tokenizer(text, return_tensors="pt").to(model.device)
-    
-    activation = {}
-    def hook(module, input, output):
-        activation['resid'] = output[0].detach()
-    
-    handle = model.model.layers[layer].register_forward_hook(hook)
-    with torch.no_grad():
-        model(**inputs)
-    handle.remove()
-    
-    # Get all positions: [seq_len, hidden_dim]
-    resid_all = activation['resid'][0, :, :].cpu().float()
-    
-    # Encode all positions through SAE
-    encoded = sae_l20.encode(resid_all)  # [seq_len, n_features]
-    
-    # Max pool across sequence for this feature
-    max_act = encoded[:, feature_idx].max().item()
-    return max_act
-
-
-def get_l20_residual(text):
-    """Get residual stream at layer 20, last token."""
-    inputs = tokenizer(text, return_tensors="pt").to(model.device)
-    
-    activation = {}
-    def hook(module, input, output):
-        activation['resid'] = output[0].detach()
-    
-    handle = model.model.layers[20].register_forward_hook(hook)
-    with torch.no_grad():
-        model(**inputs)
-    handle.remove()
-    
-    return activation['resid'][0, -1, :].cpu().float()  # Move to CPU for SAE
-
-
-def get_max_feature_activation_l9(text, feature_idx):
-    """Same as before but for layer 9"""
-    inputs = tokenizer(text, return_tensors="pt").to(model.device)
-    activation = {}
-    def hook(module, input, output):
-        activation['resid'] = output[0].detach()
-    handle = model.model.layers[9].register_forward_hook(hook)
-    with torch.no_grad():
-        model(**inputs)
-    handle.remove()
-    resid_all = activation['resid'][0, :, :].cpu().float()
-    encoded = sae_l9.encode(resid_all)
-    return encoded[:, feature_idx].max().item()
-
-
-# Collect activations - BOTH last-token and max-pooled
-print("\nRunning difference-in-means experiment...")
-true_acts_last = []
-false_acts_last = []
-true_acts_max = []
-false_acts_max = []
-
-for true_stmt, false_stmt in tqdm(pairs):
-    # Last-token method (original)
-    resid_true = get_l20_residual(true_stmt)
-    resid_false = get_l20_residual(false_stmt)
-    with torch.no_grad():
-        feat_true_last = sae_l20.encode(resid_true.unsqueeze(0))[0, FEATURE_IDX_L20].item()
-        feat_false_last = sae_l20.encode(resid_false.unsqueeze(0))[0, FEATURE_IDX_L20].item()
-    true_acts_last.append(feat_true_last)
-    false_acts_last.append(feat_false_last)
-    
-    # Max-pooled method (new)
-    feat_true_max = get_max_feature_activation(true_stmt, layer=20, feature_idx=FEATURE_IDX_L20)
-    feat_false_max = get_max_feature_activation(false_stmt, layer=20, feature_idx=FEATURE_IDX_L20)
-    true_acts_max.append(feat_true_max)
-    false_acts_max.append(feat_false_max)
-
-# Print both
-print("\n" + "="*50)
-print("Per-pair breakdown (Last-token | Max-pooled):")
-print("="*50)
-for i, (t, f) in enumerate(pairs):
-    print(f"True: {true_acts_last[i]:.2f} | {true_acts_max[i]:.2f}  "
-          f"False: {false_acts_last[i]:.2f} | {false_acts_max[i]:.2f}  | {t[:30]}...")
-
-print("\n" + "="*50)
-print("SUMMARY:")
-print("="*50)
-print("Last-token method:")
-print(f"  Mean TRUE:  {np.mean(true_acts_last):.2f}, Mean FALSE: {np.mean(false_acts_last):.2f}")
-print("Max-pooled method:")
-print(f"  Mean TRUE:  {np.mean(true_acts_max):.2f}, Mean FALSE: {np.mean(false_acts_max):.2f}")
-
-t_stat, p_val = stats.ttest_rel(true_acts_max, false_acts_max)
-print(f"Max-pooled t-test: t={t_stat:.3f}, p={p_val:.4f}")
-
-
-
-print("\n" + "="*50)
-print("Lexical check for 'truth' keyword activation:")
-test_prompts = [
-    # Should NOT fire (true statements, no word "truth")
-    "The capital of France is Paris",
-    "Water freezes at zero degrees",
-    "The Earth orbits the Sun",
-    
-    # SHOULD fire (contains "truth" or related words)
-    "The truth is that Paris is the capital",
-    "To tell the truth, I don't know",
-    "This statement is true",
-    "The truth matters",
-    "In truth, water freezes at zero",
-]
+def collect_activations(texts, layers):
+    """Residual streams of `texts` at every layer in `layers` (store-backed, see activation_store)."""
+    from activation_store import collect_activations
 
-for prompt in test_prompts:
-    resid = get_l20_residual(prompt)
-    encoded = sae_l20.encode(resid.unsqueeze(0))
-    act = encoded[0, FEATURE_IDX_L20].item()
-    print(f"{act:.2f} | {prompt}")
+    return collect_activations(texts, layers)
 
 
+def get_residual(text, layer):
+    """Residual stream at the output of `layer` for every token: [seq_len, hidden_dim] on CPU."""
+    return collect_activations([text], [layer]).tokens(layer, text)
 
 
+def get_max_feature_activation(text, layer, feature_idx):
+    """Get MAX activation of a feature across all token positions."""
+    from sae_encoders import get_subset_encoder
 
+    acts = collect_activations([text], [layer])
+    return acts.max_pool(layer, get_subset_encoder(layer, (feature_idx,)).encode)[0, 0].item()
 
-# Test
-print("\n" + "="*50)
-print(f"Max-pooled activation for feature {FEATURE_IDX_L20}:")
-print("\nShould NOT fire:")
-for prompt in ["The capital of France is Paris", "Water freezes at zero degrees", "The Earth orbits the Sun"]:
-    act = get_max_feature_activation(prompt, layer=20, feature_idx=FEATURE_IDX_L20)
-    print(f"  {act:.2f} | {prompt}")
 
-print("\nSHOULD fire:")
-for prompt in ["The truth is that Paris is the capital", "To tell the truth, I don't know", "The truth matters"]:
-    act = get_max_feature_activation(prompt, layer=20, feature_idx=FEATURE_IDX_L20)
-    print(f"  {act:.2f} | {prompt}")
+def get_l20_residual(text):
+    """Get residual stream at layer 20, last token."""
+    return get_residual(text, 20)[-1, :]
 
 
+def get_max_feature_activation_l9(text, feature_idx):
+    """Same as before but for layer 9"""
+    return get_max_feature_activation(text, 9, feature_idx)
+
+
+def rank_features(layer, pair_list=pairs, pool="max"):
+    """Paired true-vs-false statistics for every feature of the layer's SAE (see paired_stats).
+
+    Texts stream through in batches, the SAE encode of one batch overlapping
+    the forward pass of the next; each text is reduced to one activation per
+    feature (max over tokens, or the last token) and each pair is accumulated
+    as soon as both of its sides are in.
+    """
+    import torch
+    from activation_store import map_activations
+    from models import get_sae_weights
+    from paired_stats import PairedDifference
+    from sae_encoders import SparseEncoder
+
+    # Chunked sparse encoding keeps memory flat however long the texts are
+    encoder = SparseEncoder(get_sae_weights(layer))
+    stats = PairedDifference(encoder.n_features)
+
+    def reduce(acts):
+        if pool == "max":
+            pooled = [encoder.max_pool(resid) for resid in acts.residuals[layer]]
+        else:
+            pooled = list(encoder.encode(acts.last_token(layer)).to_dense())
+        return dict(zip(acts.texts, pooled))
+
+    rows = {}
+    remaining = list(pair_list)
+    for batch_rows in map_activations([s for pair in pair_list for s in pair], [layer], reduce):
+        rows.update(batch_rows)
+        ready = [pair for pair in remaining if pair[0] in rows and pair[1] in rows]
+        if ready:
+            stats.update(torch.stack([rows[t] for t, _ in ready]), torch.stack([rows[f] for _, f in ready]))
+            remaining = [pair for pair in remaining if pair not in ready]
+            needed = {s for pair in remaining for s in pair}
+            rows = {text: row for text, row in rows.items() if text in needed}
+    return stats
+
+
+@profiled("feature_validation")
+def main():
+    import numpy as np
+    from scipy import stats
+    from sae_encoders import get_subset_encoder
+
+    # Only the tracked feature of each SAE is computed
+    enc_l9 = get_subset_encoder(9, (FEATURE_IDX_L9,))
+    enc_l20 = get_subset_encoder(20, (FEATURE_IDX_L20,))
+
+    test_prompts = [
+        # Should NOT fire (true statements, no word "truth")
+        "The capital of France is Paris",
+        "Water freezes at zero degrees",
+        "The Earth orbits the Sun",
+
+        # SHOULD fire (contains "truth" or related words)
+        "The truth is that Paris is the capital",
+        "To tell the truth, I don't know",
+        "This statement is true",
+        "The truth matters",
+        "In truth, water freezes at zero",
+    ]
+    l20_quiet = ["The capital of France is Paris", "Water freezes at zero degrees", "The Earth orbits the Sun"]
+    l20_firing = ["The truth is that Paris is the capital", "To tell the truth, I don't know", "The truth matters"]
+    l9_quiet = ["The capital is Paris", "Water freezes at zero", "The answer is 42"]
+    l9_firing = ["Maybe the capital is Paris", "Perhaps water freezes", "The answer might be 42"]
+
+    # One batched pass over every sentence, hooking L9 and L20 together
+    print("\nCollecting activations...")
+    texts = [s for pair in pairs for s in pair] + test_prompts + l20_quiet + l20_firing + l9_quiet + l9_firing
+    acts = collect_activations(texts, [9, 20])
+    last_l20 = enc_l20.encode(acts.last_token(20))[:, 0]
+    max_l20 = acts.max_pool(20, enc_l20.encode)[:, 0]
+    max_l9 = acts.max_pool(9, enc_l9.encode)[:, 0]
+
+    def value(view, text):
+        return view[acts.index[text]].item()
+
+    # Collect activations - BOTH last-token and max-pooled
+    print("\nRunning difference-in-means experiment...")
+    true_acts_last = [value(last_l20, t) for t, _ in pairs]
+    false_acts_last = [value(last_l20, f) for _, f in pairs]
+    true_acts_max = [value(max_l20, t) for t, _ in pairs]
+    false_acts_max = [value(max_l20, f) for _, f in pairs]
+
+    # Print both
+    print("\n" + "="*50)
+    print("Per-pair breakdown (Last-token | Max-pooled):")
+    print("="*50)
+    for i, (t, f) in enumerate(pairs):
+        print(f"True: {true_acts_last[i]:.2f} | {true_acts_max[i]:.2f}  "
+              f"False: {false_acts_last[i]:.2f} | {false_acts_max[i]:.2f}  | {t[:30]}...")
+
+    print("\n" + "="*50)
+    print("SUMMARY:")
+    print("="*50)
+    print("Last-token method:")
+    print(f"  Mean TRUE:  {np.mean(true_acts_last):.2f}, Mean FALSE: {np.mean(false_acts_last):.2f}")
+    print("Max-pooled method:")
+    print(f"  Mean TRUE:  {np.mean(true_acts_max):.2f}, Mean FALSE: {np.mean(false_acts_max):.2f}")
+
+    t_stat, p_val = stats.ttest_rel(true_acts_max, false_acts_max)
+    print(f"Max-pooled t-test: t={t_stat:.3f}, p={p_val:.4f}")
+
+
+
+    print("\n" + "="*50)
+    print("Lexical check for 'truth' keyword activation:")
+    for prompt in test_prompts:
+        print(f"{value(last_l20, prompt):.2f} | {prompt}")
+
+
+
+
+
+
+    # Test
+    print("\n" + "="*50)
+    print(f"Max-pooled activation for feature {FEATURE_IDX_L20}:")
+    print("\nShould NOT fire:")
+    for prompt in l20_quiet:
+        print(f"  {value(max_l20, prompt):.2f} | {prompt}")
+
+    print("\nSHOULD fire:")
+    for prompt in l20_firing:
+        print(f"  {value(max_l20, prompt):.2f} | {prompt}")
+
+
+
+
+    print("\n" + "="*50)
+    print(f"Max-pooled activation for feature {FEATURE_IDX_L9} (L9 'Uncertainty'):")
+    print(f"\nL9 Feature {FEATURE_IDX_L9} (Uncertainty):")
+    print("\nShould NOT fire:")
+    for p in l9_quiet:
+        print(f"  {value(max_l9, p):.2f} | {p}")
 
+    print("\nSHOULD fire:")
+    for p in l9_firing:
+        print(f"  {value(max_l9, p):.2f} | {p}")
 
-# Load L9 SAE
-print("Loading L9 SAE...")
-sae_l9, _, _ = SAE.from_pretrained(
-    release="gemma-scope-9b-it-res-canonical",
-    sae_id="layer_9/width_131k/canonical",  # Check Neuronpedia for exact ID
-    device="cpu"
-)
+    print("\n" + "="*50)
+    print("All L20 features, paired true-vs-false (max-pooled), top 10 by |t|:")
+    for row in rank_features(20).top(10):
+        marker = " <--" if row["feature"] == FEATURE_IDX_L20 else ""
+        print(f"  {row['feature']:>6}  diff={row['mean_diff']:+.2f}  t={row['t']:+.2f}  "
+              f"p={row['p']:.4f}  d={row['effect_size']:+.2f}{marker}")
 
-print("\n" + "="*50)
-print(f"Max-pooled activation for feature {FEATURE_IDX_L9} (L9 'Uncertainty'):")
-print(f"\nL9 Feature {FEATURE_IDX_L9} (Uncertainty):")
-print("\nShould NOT fire:")
-for p in ["The capital is Paris", "Water freezes at zero", "The answer is 42"]:
-    print(f"  {get_max_feature_activation_l9(p, FEATURE_IDX_L9):.2f} | {p}")
 
-print("\nSHOULD fire:")
-for p in ["Maybe the capital is Paris", "Perhaps water freezes", "The answer might be 42"]:
-    print(f"  {get_max_feature_activation_l9(p, FEATURE_IDX_L9):.2f} | {p}")
\ No newline at end of file
+if __name__ == "__main__":
+    main()
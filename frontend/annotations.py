@@ -0,0 +1,121 @@
+"""
+Append-only journal of reviewer annotations for run CSVs.
+
+Each click in the viewer appends one (run, row, corrected) entry to a SQLite
+log instead of rewriting the run's CSV, so labeling is constant time and
+concurrent reviewers never overwrite each other's work. Records are merged
+with the latest entry per row when a run is read, and compact() folds the
+journal back into the CSV (atomically) when a clean file is wanted.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+
+import pandas as pd
+
+
+class AnnotationStore:
+    """Lock-protected SQLite journal of `corrected` flags keyed by (run type, run name, row)."""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS annotation_log (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                run_type TEXT NOT NULL,
+                run_name TEXT NOT NULL,
+                row INTEGER NOT NULL,
+                corrected INTEGER NOT NULL,
+                created REAL NOT NULL
+            )"""
+        )
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS annotation_log_run ON annotation_log(run_type, run_name, row, id)"
+        )
+        self.conn.commit()
+
+    def record(self, run_type, run_name, row, corrected):
+        """Append one annotation."""
+        with self.lock:
+            self.conn.execute(
+                "INSERT INTO annotation_log (run_type, run_name, row, corrected, created) VALUES (?, ?, ?, ?, ?)",
+                (run_type, run_name, row, int(bool(corrected)), time.time()),
+            )
+            self.conn.commit()
+
+    def latest(self, run_type, run_name):
+        """{row: corrected} from the newest journal entry of each annotated row."""
+        with self.lock:
+            rows = self.conn.execute(
+                """SELECT row, corrected FROM annotation_log
+                   WHERE id IN (SELECT MAX(id) FROM annotation_log
+                                WHERE run_type = ? AND run_name = ? GROUP BY row)""",
+                (run_type, run_name),
+            ).fetchall()
+        return {row: bool(corrected) for row, corrected in rows}
+
+    def versions(self, run_type):
+        """{run name: id of its newest journal entry} for every annotated run of run_type."""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT run_name, MAX(id) FROM annotation_log WHERE run_type = ? GROUP BY run_name",
+                (run_type,),
+            ).fetchall()
+        return dict(rows)
+
+    def corrected(self, df, run_type, run_name):
+        """Boolean Series of each record's `corrected` flag with the journal applied; df is not modified."""
+        if "corrected" in df.columns:
+            flags = df["corrected"].fillna(False).astype(bool)
+        else:
+            flags = pd.Series(False, index=df.index)
+        latest = {row: c for row, c in self.latest(run_type, run_name).items() if 0 <= row < len(df)}
+        if latest:
+            flags = flags.copy()
+            flags.iloc[list(latest)] = list(latest.values())
+        return flags
+
+    def compact(self, csv_path, run_type, run_name):
+        """Write the merged `corrected` column into the CSV and drop the folded entries.
+
+        Returns the number of journal entries folded in.
+        """
+        with self.lock:
+            last_id, count = self.conn.execute(
+                "SELECT MAX(id), COUNT(*) FROM annotation_log WHERE run_type = ? AND run_name = ?",
+                (run_type, run_name),
+            ).fetchone()
+        if not count:
+            return 0
+
+        df = pd.read_csv(csv_path)
+        with self.lock:
+            rows = self.conn.execute(
+                """SELECT row, corrected FROM annotation_log
+                   WHERE id IN (SELECT MAX(id) FROM annotation_log
+                                WHERE run_type = ? AND run_name = ? AND id <= ? GROUP BY row)""",
+                (run_type, run_name, last_id),
+            ).fetchall()
+        if "corrected" not in df.columns:
+            df["corrected"] = False
+        for row, corrected in rows:
+            if 0 <= row < len(df):
+                df.at[row, "corrected"] = bool(corrected)
+
+        tmp_path = f"{csv_path}.tmp"
+        df.to_csv(tmp_path, index=False)
+        os.replace(tmp_path, csv_path)
+
+        # Entries newer than last_id arrived during the rewrite and stay in the journal
+        with self.lock:
+            self.conn.execute(
+                "DELETE FROM annotation_log WHERE run_type = ? AND run_name = ? AND id <= ?",
+                (run_type, run_name, last_id),
+            )
+            self.conn.commit()
+        return count
@@ -2,9 +2,21 @@ from flask import Flask, render_template, request, jsonify
 import pandas as pd
 from pathlib import Path
 
+from annotations import AnnotationStore
+from run_cache import RunCache
+from run_stats import LEVELS, METRICS, RunStats
+from search_index import SearchIndex
+
 app = Flask(__name__)
 
 RUNS_BASE = Path(__file__).parent.parent / "runs"
+ANNOTATIONS_PATH = RUNS_BASE / "annotations.sqlite"
+SEARCH_INDEX_PATH = RUNS_BASE / "search.sqlite"
+RUN_STATS_PATH = RUNS_BASE / "run_stats.sqlite"
+LOGS_DIR = Path(__file__).parent.parent / "logs" / "misconceptions"
+RUN_CACHE_MAX_BYTES = 256 * 1024 * 1024
+DEFAULT_PAGE_SIZE = 25
+MAX_PAGE_SIZE = 200
 RUN_TYPES = {
     "misconceptions": {
         "dir": RUNS_BASE / "misconceptions",
@@ -21,20 +33,136 @@ RUN_TYPES = {
 }
 
 
+_annotations = None
+_search_index = None
+_run_stats = None
+run_cache = RunCache(RUN_CACHE_MAX_BYTES)
+
+
+def get_annotations() -> AnnotationStore:
+    """Shared annotation journal, opened on first use."""
+    global _annotations
+    if _annotations is None:
+        _annotations = AnnotationStore(str(ANNOTATIONS_PATH))
+    return _annotations
+
+
+def get_search_index() -> SearchIndex:
+    """Shared full-text index of runs and logs, opened on first use."""
+    global _search_index
+    if _search_index is None:
+        _search_index = SearchIndex(str(SEARCH_INDEX_PATH))
+    return _search_index
+
+
+def get_run_stats() -> RunStats:
+    """Shared store of per-run aggregates, opened on first use."""
+    global _run_stats
+    if _run_stats is None:
+        _run_stats = RunStats(str(RUN_STATS_PATH))
+    return _run_stats
+
+
+def refresh_run_stats(run_type: str) -> RunStats:
+    """Run stats with every changed (or newly annotated) run of run_type recomputed."""
+    def load(run_name):
+        df = load_run_data(run_type, run_name)
+        if df is None:
+            return None, None
+        return df, get_annotations().corrected(df, run_type, run_name)
+
+    runs_dir = RUN_TYPES[run_type]["dir"]
+    stats = get_run_stats()
+    stats.refresh(
+        run_type,
+        {name: runs_dir / f"{name}.csv" for name in get_available_runs(run_type)},
+        load,
+        get_annotations().versions(run_type),
+    )
+    return stats
+
+
+def search_sources():
+    """(kind, name, path) of every run CSV and misconceptions log the search index covers."""
+    for run_type, info in RUN_TYPES.items():
+        for name in get_available_runs(run_type):
+            yield run_type, name, info["dir"] / f"{name}.csv"
+    for name in run_cache.list_dir(LOGS_DIR, "*.txt"):
+        yield "log", name, LOGS_DIR / f"{name}.txt"
+
+
 def get_available_runs(run_type: str):
     """Get list of available CSV run files for a given run type."""
-    runs_dir = RUN_TYPES[run_type]["dir"]
-    csv_files = sorted(runs_dir.glob("*.csv"), reverse=True)
-    return [f.stem for f in csv_files]
+    return run_cache.list_dir(RUN_TYPES[run_type]["dir"])
 
 
-def load_run_data(run_type: str, run_name: str) -> pd.DataFrame:
-    """Load data from a specific run CSV file."""
+def load_run_data(run_type: str, run_name: str):
+    """Parsed records of a run CSV, shared through the run cache (do not mutate), or None."""
     runs_dir = RUN_TYPES[run_type]["dir"]
-    csv_path = runs_dir / f"{run_name}.csv"
-    if not csv_path.exists():
-        return pd.DataFrame()
-    return pd.read_csv(csv_path)
+    return run_cache.read_csv(runs_dir / f"{run_name}.csv")
+
+
+def _flag(value: str):
+    """'true'/'false' query argument -> bool, anything else -> None (no filter)."""
+    return {"true": True, "false": False}.get(value.lower())
+
+
+def query_records(df: pd.DataFrame, corrected: pd.Series, args) -> dict:
+    """Filter, sort and paginate a run's records from request args.
+
+    Args (all optional): config, settings, corrected (true/false), q (prompt
+    substring, case-insensitive), sort (a column or "index"), order
+    (asc/desc), page (from 1) and per_page (at most MAX_PAGE_SIZE).
+    Only the requested page is converted to records.
+    """
+    mask = pd.Series(True, index=df.index)
+    for arg, column in (("config", "config_name"), ("settings", "settings")):
+        value = args.get(arg, "")
+        if value and column in df.columns:
+            mask &= df[column].astype(str) == value
+    flag = _flag(args.get("corrected", ""))
+    if flag is not None:
+        mask &= corrected == flag
+    q = args.get("q", "").strip()
+    if q:
+        mask &= df["prompt"].astype(str).str.contains(q, case=False, regex=False, na=False)
+    rows = df.index[mask.to_numpy()]
+
+    sort = args.get("sort", "index")
+    descending = args.get("order", "asc") == "desc"
+    if sort == "corrected":
+        keys = corrected.loc[rows]
+    elif sort in df.columns:
+        keys = df.loc[rows, sort]
+    elif sort == "index":
+        keys = None
+    else:
+        raise ValueError(f"Unknown sort column '{sort}'")
+    if keys is not None:
+        rows = keys.sort_values(ascending=not descending, kind="stable").index
+    elif descending:
+        rows = rows[::-1]
+
+    per_page = min(max(args.get("per_page", DEFAULT_PAGE_SIZE, type=int), 1), MAX_PAGE_SIZE)
+    pages = max(1, -(-len(rows) // per_page))
+    page = min(max(args.get("page", 1, type=int), 1), pages)
+    page_rows = rows[(page - 1) * per_page : page * per_page]
+
+    records = df.loc[page_rows].astype(object)
+    records = records.where(records.notna(), None)
+    records["corrected"] = corrected.loc[page_rows]
+    records["index"] = page_rows
+    # Stress runs recorded before the baseline column have no default response
+    if "default_response" in records.columns:
+        records["default_response"] = records["default_response"].fillna("")
+    return {
+        "total": len(df),
+        "matched": len(rows),
+        "page": page,
+        "pages": pages,
+        "per_page": per_page,
+        "records": records.to_dict("records"),
+    }
 
 
 @app.route("/")
@@ -43,6 +171,32 @@ def index():
     return index_by_type("misconceptions")
 
 
+@app.route("/search")
+def search_page():
+    """Full-text search over every run's prompts and responses."""
+    return render_template(
+        "search.html",
+        query=request.args.get("q", ""),
+        run_types=RUN_TYPES,
+        page_size=DEFAULT_PAGE_SIZE,
+    )
+
+
+@app.route("/search/hits")
+def search_hits():
+    """Ranked, highlighted matches for q as JSON, optionally limited to one kind (a run type or "log")."""
+    query = request.args.get("q", "")
+    kind = request.args.get("kind") or None
+    per_page = min(max(request.args.get("per_page", DEFAULT_PAGE_SIZE, type=int), 1), MAX_PAGE_SIZE)
+    page = max(request.args.get("page", 1, type=int), 1)
+
+    index = get_search_index()
+    # Re-reads only sources added or changed since the last search
+    index.refresh(search_sources())
+    result = index.search(query, kind=kind, limit=per_page, offset=(page - 1) * per_page)
+    return jsonify({**result, "page": page, "per_page": per_page})
+
+
 @app.route("/<run_type>")
 def index_by_type(run_type: str):
     """Main page showing list of available runs for a given type."""
@@ -60,6 +214,45 @@ def index_by_type(run_type: str):
     )
 
 
+@app.route("/<run_type>/compare")
+def compare_runs(run_type: str):
+    """Side-by-side aggregate metrics of every run of a type."""
+    if run_type not in RUN_TYPES:
+        return render_template("error.html", message=f"Unknown run type '{run_type}'"), 404
+
+    level = request.args.get("level", "config")
+    metric = request.args.get("metric", "correction_rate")
+    if level not in LEVELS or level == "run" or metric not in METRICS:
+        return render_template("error.html", message="Unknown comparison level or metric"), 400
+
+    stats = refresh_run_stats(run_type)
+    keys, runs, cells = stats.compare(run_type, level, metric)
+    return render_template(
+        "compare.html",
+        run_type=run_type,
+        title=RUN_TYPES[run_type]["title"],
+        summary=stats.rows(run_type, "run"),
+        metrics=METRICS,
+        metric=metric,
+        level=level,
+        keys=keys,
+        runs=runs,
+        cells=cells,
+    )
+
+
+@app.route("/<run_type>/aggregates")
+def run_aggregates(run_type: str):
+    """Stored aggregates of one level (run, config or strength) for every run of a type, as JSON."""
+    if run_type not in RUN_TYPES:
+        return jsonify({"error": f"Unknown run type '{run_type}'"}), 404
+
+    level = request.args.get("level", "run")
+    if level not in LEVELS:
+        return jsonify({"error": f"Unknown level '{level}'"}), 400
+    return jsonify({"level": level, "rows": refresh_run_stats(run_type).rows(run_type, level)})
+
+
 @app.route("/<run_type>/run/<run_name>")
 def view_run(run_type: str, run_name: str):
     """View details of a specific run."""
@@ -67,21 +260,15 @@ def view_run(run_type: str, run_name: str):
         return render_template("error.html", message=f"Unknown run type '{run_type}'"), 404
 
     df = load_run_data(run_type, run_name)
-    if df.empty:
+    if df is None or df.empty:
         return render_template("error.html", message=f"Run '{run_name}' not found"), 404
 
-    # Ensure 'corrected' column exists
-    if "corrected" not in df.columns:
-        df["corrected"] = False
-
-    records = df.to_dict("records")
-
-    # Extract unique filter options for stress tests
+    # Records are fetched a page at a time from the records endpoint
     filter_options = {}
     if run_type == "stress_test":
         filter_options = {
-            "config_names": sorted(df["config_name"].unique().tolist()),
-            "settings": sorted(df["settings"].unique().tolist()),
+            "config_names": sorted(df["config_name"].astype(str).unique().tolist()),
+            "settings": sorted(df["settings"].astype(str).unique().tolist()),
         }
 
     template = RUN_TYPES[run_type]["template"]
@@ -89,12 +276,32 @@ def view_run(run_type: str, run_name: str):
         template,
         run_name=run_name,
         run_type=run_type,
-        records=records,
+        total=len(df),
+        sort_columns=[c for c in df.columns if c not in ("prompt", "default_response", "steered_response")],
+        page_size=DEFAULT_PAGE_SIZE,
         title=RUN_TYPES[run_type]["title"],
         filter_options=filter_options,
     )
 
 
+@app.route("/<run_type>/run/<run_name>/records")
+def run_records(run_type: str, run_name: str):
+    """One page of a run's filtered, sorted records as JSON (see query_records)."""
+    if run_type not in RUN_TYPES:
+        return jsonify({"error": f"Unknown run type '{run_type}'"}), 404
+
+    df = load_run_data(run_type, run_name)
+    if df is None:
+        return jsonify({"error": f"Run '{run_name}' not found"}), 404
+
+    # Labels live in the annotation journal until they are compacted into the CSV
+    corrected = get_annotations().corrected(df, run_type, run_name)
+    try:
+        return jsonify(query_records(df, corrected, request.args))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+
 @app.route("/<run_type>/run/<run_name>/update_corrected", methods=["POST"])
 def update_corrected(run_type: str, run_name: str):
     """Update the corrected status for a specific record."""
@@ -111,19 +318,32 @@ def update_corrected(run_type: str, run_name: str):
     if not csv_path.exists():
         return jsonify({"error": f"Run '{run_name}' not found"}), 404
 
-    df = pd.read_csv(csv_path)
+    # Out-of-range rows are ignored when the journal is merged
+    if not isinstance(record_index, int) or record_index < 0:
+        return jsonify({"error": "Invalid record index"}), 400
 
-    # Ensure 'corrected' column exists
-    if "corrected" not in df.columns:
-        df["corrected"] = False
+    get_annotations().record(run_type, run_name, record_index, corrected)
+    return jsonify({"success": True, "corrected": corrected})
 
-    # Update the specific record
-    if 0 <= record_index < len(df):
-        df.at[record_index, "corrected"] = corrected
-        df.to_csv(csv_path, index=False)
-        return jsonify({"success": True, "corrected": corrected})
-    else:
-        return jsonify({"error": "Invalid record index"}), 400
+
+@app.route("/<run_type>/run/<run_name>/compact_annotations", methods=["POST"])
+def compact_annotations(run_type: str, run_name: str):
+    """Fold the run's journaled annotations back into its CSV."""
+    if run_type not in RUN_TYPES:
+        return jsonify({"error": f"Unknown run type '{run_type}'"}), 404
+
+    csv_path = RUN_TYPES[run_type]["dir"] / f"{run_name}.csv"
+    if not csv_path.exists():
+        return jsonify({"error": f"Run '{run_name}' not found"}), 404
+
+    folded = get_annotations().compact(str(csv_path), run_type, run_name)
+    return jsonify({"success": True, "folded": folded})
+
+
+@app.route("/_debug/cache")
+def debug_cache():
+    """Hit/miss and memory stats of the parsed-run cache."""
+    return jsonify(run_cache.info())
 
 
 if __name__ == "__main__":
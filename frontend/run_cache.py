@@ -0,0 +1,87 @@
+"""
+Process-wide cache of parsed run CSVs and run directory listings.
+
+Entries are keyed by path and validated against the file's mtime and size
+on every lookup (one stat call), so an edited or rewritten CSV is reparsed
+and everything else is served from memory. Parsed runs are evicted least
+recently used once their total in-memory size passes `max_bytes`.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+
+class RunCache:
+    """LRU of parsed DataFrames and directory listings, invalidated by mtime/size."""
+
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.runs = OrderedDict()  # path -> (mtime_ns, size, DataFrame, nbytes)
+        self.listings = {}  # (directory, pattern) -> (mtime_ns, names)
+        self.bytes = 0
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "listing_hits": 0, "listing_misses": 0}
+
+    def read_csv(self, path):
+        """Parsed CSV at path (callers must not mutate it), or None if the file does not exist."""
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        key = str(path)
+        with self.lock:
+            entry = self.runs.get(key)
+            if entry is not None and entry[:2] == (st.st_mtime_ns, st.st_size):
+                self.stats["hits"] += 1
+                self.runs.move_to_end(key)
+                return entry[2]
+            self.stats["misses"] += 1
+
+        df = pd.read_csv(path)
+        nbytes = int(df.memory_usage(deep=True).sum())
+        with self.lock:
+            old = self.runs.pop(key, None)
+            if old is not None:
+                self.bytes -= old[3]
+            self.runs[key] = (st.st_mtime_ns, st.st_size, df, nbytes)
+            self.bytes += nbytes
+            # Always keep the entry just read, even if it alone exceeds the cap
+            while self.bytes > self.max_bytes and len(self.runs) > 1:
+                _, evicted = self.runs.popitem(last=False)
+                self.bytes -= evicted[3]
+                self.stats["evictions"] += 1
+        return df
+
+    def list_dir(self, directory, pattern="*.csv"):
+        """Sorted (newest name first) stems of files matching pattern, re-globbed only when the directory changes."""
+        try:
+            mtime = os.stat(directory).st_mtime_ns
+        except FileNotFoundError:
+            return []
+        key = (str(directory), pattern)
+        with self.lock:
+            entry = self.listings.get(key)
+            if entry is not None and entry[0] == mtime:
+                self.stats["listing_hits"] += 1
+                return entry[1]
+            self.stats["listing_misses"] += 1
+
+        names = [f.stem for f in sorted(directory.glob(pattern), reverse=True)]
+        with self.lock:
+            self.listings[key] = (mtime, names)
+        return names
+
+    def info(self):
+        with self.lock:
+            lookups = self.stats["hits"] + self.stats["misses"]
+            return {
+                **self.stats,
+                "hit_rate": self.stats["hits"] / lookups if lookups else 0.0,
+                "entries": len(self.runs),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "runs": list(self.runs),
+            }
@@ -0,0 +1,201 @@
+"""
+Persisted per-run, per-config and per-strength statistics of runs.
+
+For every run, RunStats stores one row of metrics for the whole run, one per
+config_name and one per settings string (the features and strengths used),
+in SQLite. refresh() compares each run's mtime, size and annotation journal
+version with what was aggregated and recomputes only runs that changed, so
+the comparison page reads a handful of stored rows instead of every CSV.
+
+Metrics:
+    correction_rate  share of records marked corrected
+    error_rate       share of records whose steering call failed
+    mean_length      mean steered response length (characters), errors excluded
+    changed_rate     share of steered responses that differ from the baseline
+    length_delta     mean steered minus baseline length (characters)
+
+The baseline metrics cover only records that have a default response.
+"""
+
+import math
+import os
+import sqlite3
+import threading
+
+METRICS = {
+    "correction_rate": "Correction rate",
+    "error_rate": "Error rate",
+    "mean_length": "Mean response length",
+    "changed_rate": "Changed vs baseline",
+    "length_delta": "Length change vs baseline",
+}
+
+# Aggregation level -> column grouped by (None for the whole run)
+LEVELS = {"run": None, "config": "config_name", "strength": "settings"}
+
+
+def _errors(df):
+    """Boolean Series: records whose steering failed (empty or ERROR response, or a non-Success status)."""
+    steered = df["steered_response"].fillna("").astype(str).str.strip()
+    errors = (steered == "") | steered.str.startswith("ERROR")
+    if "status" in df.columns:
+        errors |= df["status"].fillna("").astype(str) != "Success"
+    return errors
+
+
+def _metrics(df, corrected, errors):
+    ok = ~errors
+    steered = df["steered_response"].fillna("").astype(str)
+    metrics = {
+        "n": len(df),
+        "correction_rate": corrected.mean(),
+        "error_rate": errors.mean(),
+        "mean_length": steered[ok].str.len().mean(),
+        "changed_rate": None,
+        "length_delta": None,
+    }
+    if "default_response" in df.columns:
+        default = df["default_response"].fillna("").astype(str)
+        has_baseline = ok & (default.str.strip() != "")
+        if has_baseline.any():
+            norm_steered = steered[has_baseline].str.split().str.join(" ")
+            norm_default = default[has_baseline].str.split().str.join(" ")
+            metrics["changed_rate"] = (norm_steered != norm_default).mean()
+            metrics["length_delta"] = (steered[has_baseline].str.len() - default[has_baseline].str.len()).mean()
+    # NaN (e.g. the mean length of a group that only has errors) is stored as NULL
+    return {k: None if v is None or (isinstance(v, float) and math.isnan(v)) else float(v)
+            for k, v in metrics.items()}
+
+
+def aggregate(df, corrected):
+    """[(level, key, position, metrics)] for a run's records; position orders keys by first appearance."""
+    errors = _errors(df)
+    rows = [("run", "", 0, _metrics(df, corrected, errors))]
+    for level, column in LEVELS.items():
+        if column is None or column not in df.columns:
+            continue
+        keys = df[column].fillna("").astype(str)
+        for position, (key, index) in enumerate(keys.groupby(keys, sort=False).groups.items()):
+            rows.append((level, key, position, _metrics(df.loc[index], corrected.loc[index], errors.loc[index])))
+    return rows
+
+
+class RunStats:
+    """Lock-protected SQLite store of aggregate metrics, keyed by (run type, run name, level, key)."""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        columns = ", ".join(f"{metric} REAL" for metric in METRICS)
+        self.conn.executescript(
+            f"""
+            CREATE TABLE IF NOT EXISTS runs (
+                run_type TEXT NOT NULL,
+                run_name TEXT NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                annotations INTEGER NOT NULL,
+                PRIMARY KEY (run_type, run_name)
+            );
+            CREATE TABLE IF NOT EXISTS aggregates (
+                run_type TEXT NOT NULL,
+                run_name TEXT NOT NULL,
+                level TEXT NOT NULL,
+                key TEXT NOT NULL,
+                position INTEGER NOT NULL,
+                n INTEGER NOT NULL,
+                {columns},
+                PRIMARY KEY (run_type, run_name, level, key)
+            );
+            """
+        )
+        self.conn.commit()
+
+    def _drop(self, run_type, run_name):
+        self.conn.execute("DELETE FROM aggregates WHERE run_type = ? AND run_name = ?", (run_type, run_name))
+        self.conn.execute("DELETE FROM runs WHERE run_type = ? AND run_name = ?", (run_type, run_name))
+
+    def refresh(self, run_type, runs, load, annotation_versions):
+        """Recompute the runs of run_type that changed since they were aggregated.
+
+        runs maps run name -> CSV path, load(run_name) returns (records,
+        corrected flags), and annotation_versions maps run name -> newest
+        journal entry id. Runs no longer present are dropped. Returns the
+        number of runs recomputed.
+        """
+        with self.lock:
+            stored = {
+                name: (mtime, size, annotations)
+                for name, mtime, size, annotations in self.conn.execute(
+                    "SELECT run_name, mtime_ns, size, annotations FROM runs WHERE run_type = ?", (run_type,)
+                )
+            }
+            for name in stored.keys() - runs.keys():
+                self._drop(run_type, name)
+            self.conn.commit()
+
+        changed = 0
+        for name, path in runs.items():
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            version = (st.st_mtime_ns, st.st_size, annotation_versions.get(name, 0))
+            if stored.get(name) == version:
+                continue
+            df, corrected = load(name)
+            if df is None:
+                continue
+            rows = aggregate(df, corrected)
+            with self.lock:
+                self._drop(run_type, name)
+                self.conn.executemany(
+                    f"""INSERT INTO aggregates (run_type, run_name, level, key, position, n, {", ".join(METRICS)})
+                        VALUES ({", ".join("?" * (6 + len(METRICS)))})""",
+                    [
+                        (run_type, name, level, key, position, int(m["n"]), *(m[metric] for metric in METRICS))
+                        for level, key, position, m in rows
+                    ],
+                )
+                self.conn.execute(
+                    "INSERT INTO runs (run_type, run_name, mtime_ns, size, annotations) VALUES (?, ?, ?, ?, ?)",
+                    (run_type, name, *version),
+                )
+                self.conn.commit()
+            changed += 1
+        return changed
+
+    def rows(self, run_type, level="run"):
+        """Stored aggregates of one level as dicts (run_name, key, n and every metric)."""
+        with self.lock:
+            cursor = self.conn.execute(
+                f"""SELECT run_name, key, n, {", ".join(METRICS)} FROM aggregates
+                    WHERE run_type = ? AND level = ?
+                    ORDER BY run_name, position""",
+                (run_type, level),
+            )
+            names = [d[0] for d in cursor.description]
+            return [dict(zip(names, row)) for row in cursor.fetchall()]
+
+    def compare(self, run_type, level, metric):
+        """Pivot of one metric: (keys, run names, {(key, run_name): value}) for a config or strength level.
+
+        Keys are ordered by where they first appear across runs.
+        """
+        if metric not in METRICS:
+            raise ValueError(f"Unknown metric '{metric}'")
+        with self.lock:
+            cells = self.conn.execute(
+                f"""SELECT key, run_name, {metric} FROM aggregates
+                    WHERE run_type = ? AND level = ?""",
+                (run_type, level),
+            ).fetchall()
+            keys = [key for key, in self.conn.execute(
+                """SELECT key FROM aggregates WHERE run_type = ? AND level = ?
+                   GROUP BY key ORDER BY MIN(position), key""",
+                (run_type, level),
+            )]
+        runs = sorted({run_name for _, run_name, _ in cells})
+        return keys, runs, {(key, run_name): value for key, run_name, value in cells}
@@ -0,0 +1,203 @@
+"""
+Full-text index over the prompts and responses of every run and log.
+
+Each source (a run CSV or a logs/misconceptions/*.txt file) is indexed into a
+SQLite FTS5 table, one document per prompt with its default and steered
+responses. refresh() compares every source's mtime and size with what was
+indexed and re-reads only new or changed files, dropping sources that have
+disappeared, so it is cheap to call before each search.
+"""
+
+import ast
+import csv
+import os
+import re
+import sqlite3
+import threading
+
+from markupsafe import escape
+
+# Sentinels wrapped around matched terms by FTS5, swapped for <mark> after escaping
+_OPEN, _CLOSE = "\x02", "\x03"
+
+_LOG_PROMPT = re.compile(r"^\[(\d+)/\d+\] Testing: (.*)$")
+_LOG_RESPONSE = re.compile(r"^\s*-> (Default|Steered): (.*)$")
+
+
+def read_csv_documents(path):
+    """(row, prompt, default_response, steered_response) for each record of a run CSV."""
+    with open(path, newline="", encoding="utf-8") as f:
+        for row, record in enumerate(csv.DictReader(f)):
+            yield (
+                row,
+                record.get("prompt") or "",
+                record.get("default_response") or "",
+                record.get("steered_response") or "",
+            )
+
+
+def read_log_documents(path):
+    """(row, prompt, default_response, steered_response) for each prompt of a run log."""
+    doc = None
+    with open(path, encoding="utf-8", errors="replace") as f:
+        for line in f:
+            line = line.rstrip("\n")
+            if m := _LOG_PROMPT.match(line):
+                if doc:
+                    yield tuple(doc)
+                prompt = m.group(2)
+                try:
+                    prompt = ast.literal_eval(prompt)
+                except (ValueError, SyntaxError):
+                    pass
+                doc = [int(m.group(1)) - 1, str(prompt), "", ""]
+            elif doc and (m := _LOG_RESPONSE.match(line)):
+                doc[2 if m.group(1) == "Default" else 3] = m.group(2)
+    if doc:
+        yield tuple(doc)
+
+
+def _match_expression(query):
+    """User query -> FTS5 expression: every term must match, a trailing * makes it a prefix."""
+    terms = []
+    for term in query.split():
+        prefix = term.endswith("*")
+        term = term.rstrip("*").replace('"', '""')
+        if term:
+            terms.append(f'"{term}"' + ("*" if prefix else ""))
+    return " ".join(terms)
+
+
+def _highlighted(text):
+    """FTS5 highlight() output -> HTML-escaped text with <mark>ed matches."""
+    return str(escape(text or "")).replace(_OPEN, "<mark>").replace(_CLOSE, "</mark>")
+
+
+class SearchIndex:
+    """Lock-protected SQLite FTS5 index of (kind, run name, row) documents."""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS sources (
+                path TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                name TEXT NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                size INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS documents (
+                id INTEGER PRIMARY KEY,
+                path TEXT NOT NULL,
+                row INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS documents_path ON documents(path);
+            CREATE VIRTUAL TABLE IF NOT EXISTS documents_fts USING fts5(
+                prompt, default_response, steered_response, tokenize = 'porter unicode61'
+            );
+            """
+        )
+        self.conn.commit()
+
+    def _drop(self, path):
+        self.conn.execute(
+            "DELETE FROM documents_fts WHERE rowid IN (SELECT id FROM documents WHERE path = ?)", (path,)
+        )
+        self.conn.execute("DELETE FROM documents WHERE path = ?", (path,))
+        self.conn.execute("DELETE FROM sources WHERE path = ?", (path,))
+
+    def refresh(self, sources):
+        """Bring the index up to date with sources, an iterable of (kind, name, path).
+
+        Returns the number of sources (re)indexed.
+        """
+        sources = {str(path): (kind, name) for kind, name, path in sources}
+        with self.lock:
+            indexed = {
+                path: (mtime, size)
+                for path, mtime, size in self.conn.execute("SELECT path, mtime_ns, size FROM sources")
+            }
+        changed = 0
+        for path in indexed.keys() - sources.keys():
+            with self.lock:
+                self._drop(path)
+                self.conn.commit()
+
+        for path, (kind, name) in sources.items():
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            if indexed.get(path) == (st.st_mtime_ns, st.st_size):
+                continue
+            reader = read_log_documents if path.endswith(".txt") else read_csv_documents
+            try:
+                docs = list(reader(path))
+            except (OSError, UnicodeDecodeError, csv.Error) as e:
+                print(f"Skipping {path} in search index: {e}")
+                continue
+            with self.lock:
+                self._drop(path)
+                for row, prompt, default, steered in docs:
+                    doc_id = self.conn.execute(
+                        "INSERT INTO documents (path, row) VALUES (?, ?)", (path, row)
+                    ).lastrowid
+                    self.conn.execute(
+                        "INSERT INTO documents_fts (rowid, prompt, default_response, steered_response)"
+                        " VALUES (?, ?, ?, ?)",
+                        (doc_id, prompt, default, steered),
+                    )
+                self.conn.execute(
+                    "INSERT INTO sources (path, kind, name, mtime_ns, size) VALUES (?, ?, ?, ?, ?)",
+                    (path, kind, name, st.st_mtime_ns, st.st_size),
+                )
+                self.conn.commit()
+            changed += 1
+        return changed
+
+    def search(self, query, kind=None, limit=20, offset=0):
+        """Best-ranked (BM25) documents matching every term of query.
+
+        Returns {"total", "hits"}; each hit has kind, name, row, score and
+        prompt/default_response/steered_response as HTML with <mark>ed terms
+        (responses are shortened to snippets around the matches).
+        """
+        expression = _match_expression(query)
+        if not expression:
+            return {"total": 0, "hits": []}
+        kind_clause = "AND s.kind = ?" if kind else ""
+        params = (expression, kind) if kind else (expression,)
+        joins = """FROM documents_fts f
+                   JOIN documents d ON d.id = f.rowid
+                   JOIN sources s ON s.path = d.path
+                   WHERE documents_fts MATCH ? """ + kind_clause
+        with self.lock:
+            total = self.conn.execute(f"SELECT COUNT(*) {joins}", params).fetchone()[0]
+            rows = self.conn.execute(
+                f"""SELECT s.kind, s.name, d.row, bm25(documents_fts),
+                           highlight(documents_fts, 0, '{_OPEN}', '{_CLOSE}'),
+                           snippet(documents_fts, 1, '{_OPEN}', '{_CLOSE}', '…', 40),
+                           snippet(documents_fts, 2, '{_OPEN}', '{_CLOSE}', '…', 40)
+                    {joins}
+                    ORDER BY bm25(documents_fts)
+                    LIMIT ? OFFSET ?""",
+                params + (limit, offset),
+            ).fetchall()
+        hits = [
+            {
+                "kind": kind,
+                "name": name,
+                "row": row,
+                # bm25() is lower for better matches
+                "score": -score,
+                "prompt": _highlighted(prompt),
+                "default_response": _highlighted(default),
+                "steered_response": _highlighted(steered),
+            }
+            for kind, name, row, score, prompt, default, steered in rows
+        ]
+        return {"total": total, "hits": hits}
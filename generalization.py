@@ -1,23 +1,14 @@
 import os
 import csv
-import time
 from datetime import datetime
-from neuronpedia import steering_completion
+from neuronpedia import MAX_WORKERS, REQUESTS_PER_SECOND, SteeringError, steering_completion_many
 
 from prompts import MISCONCEPTIONS
 
 # --- CONFIGURATION ---
-RUN_TIMESTAMP = datetime.now().strftime("%Y%m%d_%H%M%S")
 RUN_DIR = f"runs/misconceptions"
 LOG_DIR = f"logs/misconceptions"
 
-# Create directories if they don't exist
-os.makedirs(RUN_DIR, exist_ok=True)
-os.makedirs(LOG_DIR, exist_ok=True)
-
-CSV_FILENAME = f"{RUN_DIR}/run_{RUN_TIMESTAMP}.csv"
-LOG_FILENAME = f"{LOG_DIR}/run_{RUN_TIMESTAMP}.txt"
-
 # The "Doubt-Truth" Combo
 FEATURE_SET = [
     (80216, 35, "9-gemmascope-res-131k"),   # L9: Uncertainty (The Destabilizer)
@@ -31,40 +22,61 @@ def log_print(message, file):
     print(message)
     file.write(message + "\n")
 
-print(f"--- STARTING GENERALIZATION TEST (n={len(MISCONCEPTIONS)}) ---")
-print(f"Saving to: {CSV_FILENAME}")
-
-with open(CSV_FILENAME, mode='w', newline='', encoding='utf-8') as csv_file, \
-     open(LOG_FILENAME, mode='w', encoding='utf-8') as log_file:
-    
-    writer = csv.DictWriter(csv_file, fieldnames=["prompt", "default_response", "steered_response", "status"])
-    writer.writeheader()
-
-    for i, prompt in enumerate(MISCONCEPTIONS, 1):
-        log_print(f"[{i}/{len(MISCONCEPTIONS)}] Testing: '{prompt}'", log_file)
-        
-        try:
-            steered, default = steering_completion(prompt, FEATURE_SET)
-            
-            # Clean strings for CSV
-            clean_default = default.replace("\n", " ").replace("\r", "")
-            clean_steered = steered.replace("\n", " ").replace("\r", "")
-            
-            writer.writerow({
-                "prompt": prompt,
-                "default_response": clean_default,
-                "steered_response": clean_steered,
-                "status": "Success"
-            })
-            
-            log_print(f"   -> Default: {clean_default}", log_file)
-            log_print(f"   -> Steered: {clean_steered}", log_file)
-            
-        except Exception as e:
-            log_print(f"   -> ERROR: {e}", log_file)
-            writer.writerow({"prompt": prompt, "status": f"Error: {e}"})
-
-        log_print("-" * 60, log_file)
-        time.sleep(1) # Rate limit kindness
-
-print("\nDone! Results saved.")
\ No newline at end of file
+
+def main():
+    run_timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    csv_filename = f"{RUN_DIR}/run_{run_timestamp}.csv"
+    log_filename = f"{LOG_DIR}/run_{run_timestamp}.txt"
+
+    # Create directories if they don't exist
+    os.makedirs(RUN_DIR, exist_ok=True)
+    os.makedirs(LOG_DIR, exist_ok=True)
+
+    print(f"--- STARTING GENERALIZATION TEST (n={len(MISCONCEPTIONS)}) ---")
+    print(f"Saving to: {csv_filename}")
+
+    with open(csv_filename, mode='w', newline='', encoding='utf-8') as csv_file, \
+         open(log_filename, mode='w', encoding='utf-8') as log_file:
+
+        writer = csv.DictWriter(csv_file, fieldnames=["prompt", "default_response", "steered_response", "status"])
+        writer.writeheader()
+
+        results = steering_completion_many(
+            [(prompt, FEATURE_SET) for prompt in MISCONCEPTIONS],
+            max_workers=MAX_WORKERS,
+            requests_per_second=REQUESTS_PER_SECOND,
+        )
+
+        for i, (prompt, result) in enumerate(zip(MISCONCEPTIONS, results), 1):
+            log_print(f"[{i}/{len(MISCONCEPTIONS)}] Testing: '{prompt}'", log_file)
+
+            try:
+                if isinstance(result, SteeringError):
+                    raise result
+                steered, default = result
+
+                # Clean strings for CSV
+                clean_default = default.replace("\n", " ").replace("\r", "")
+                clean_steered = steered.replace("\n", " ").replace("\r", "")
+
+                writer.writerow({
+                    "prompt": prompt,
+                    "default_response": clean_default,
+                    "steered_response": clean_steered,
+                    "status": "Success"
+                })
+
+                log_print(f"   -> Default: {clean_default}", log_file)
+                log_print(f"   -> Steered: {clean_steered}", log_file)
+
+            except Exception as e:
+                log_print(f"   -> ERROR: {e}", log_file)
+                writer.writerow({"prompt": prompt, "status": f"Error: {e}"})
+
+            log_print("-" * 60, log_file)
+
+    print("\nDone! Results saved.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Load test the steering client against the local mock API.
+
+Starts mock_neuronpedia in-process, points neuronpedia at it and pushes the
+systematic_test grid through steering_completion with the sweep concurrency
+settings. Reports throughput, latency percentiles and how many injected
+failures the client recovered from.
+"""
+
+import json
+import time
+import logging
+import argparse
+import threading
+from werkzeug.serving import make_server
+
+import neuronpedia
+from neuronpedia import SteeringError, run_concurrently, steering_completion
+from mock_neuronpedia import add_fault_arguments, create_app, faults_from_args
+from systematic_test import build_cells
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else 0.0
+
+
+def timed_completion(prompt, features):
+    """(seconds including retries, SteeringError or None) for one steering call."""
+    start = time.perf_counter()
+    error = None
+    try:
+        steering_completion(prompt, features)
+    except SteeringError as e:
+        error = e
+    return time.perf_counter() - start, error
+
+
+def run_load_test(faults, repeat=1, max_workers=neuronpedia.MAX_WORKERS,
+                  requests_per_second=neuronpedia.REQUESTS_PER_SECOND):
+    """Run the grid `repeat` times against a fresh mock server and return a report dict."""
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    app = create_app(faults)
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    # Talk to the mock, and never answer from (or write to) the response cache
+    api_url, cache_path = neuronpedia.API_URL, neuronpedia.CACHE_PATH
+    neuronpedia.API_URL = f"http://127.0.0.1:{server.server_port}/api"
+    neuronpedia.CACHE_PATH = ""
+    try:
+        jobs = [(prompt, features) for _, (prompt, _, _, features) in build_cells()] * repeat
+        start = time.perf_counter()
+        results = list(run_concurrently(timed_completion, jobs, max_workers, requests_per_second))
+        elapsed = time.perf_counter() - start
+    finally:
+        neuronpedia.API_URL, neuronpedia.CACHE_PATH = api_url, cache_path
+        server.shutdown()
+
+    latencies = [seconds for seconds, _ in results]
+    errors = [error for _, error in results if error is not None]
+    injected = faults.stats["429"] + faults.stats["5xx"]
+    return {
+        "calls": len(results),
+        "http_requests": faults.stats["requests"],
+        "elapsed_s": round(elapsed, 3),
+        "calls_per_s": round(len(results) / elapsed, 3) if elapsed else 0.0,
+        "latency_p50_s": round(percentile(latencies, 0.50), 3),
+        "latency_p99_s": round(percentile(latencies, 0.99), 3),
+        "injected_429": faults.stats["429"],
+        "injected_5xx": faults.stats["5xx"],
+        # Faults on calls that eventually succeeded; every attempt of a failed call was a fault
+        "recovered_faults": injected - sum(error.attempts for error in errors),
+        "failed_calls": len(errors),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the steering client against a local mock API.")
+    parser.add_argument("--repeat", type=int, default=1, help="times to run the stress test grid")
+    parser.add_argument("--max-workers", type=int, default=neuronpedia.MAX_WORKERS)
+    parser.add_argument("--requests-per-second", type=float, default=neuronpedia.REQUESTS_PER_SECOND)
+    add_fault_arguments(parser)
+    args = parser.parse_args()
+
+    report = run_load_test(faults_from_args(args), args.repeat, args.max_workers, args.requests_per_second)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,381 @@
+"""
+Local, in-process steering backend.
+
+Steering is SIMPLE_ADDITIVE, as on Neuronpedia: `strength * W_dec[index]` is
+added to the residual stream output of each hooked layer.
+
+steering_completion / steering_completion_many mirror the /steer client in
+neuronpedia.py, but generate a whole batch of left-padded prompts per call,
+each row with its own steering vectors, and need no network. LocalBackend
+takes any model, tokenizer and SAE loader, so a tiny random Gemma-2 and a
+synthetic W_dec work on CPU.
+
+Multi-turn sycophancy chats re-encode a long shared conversation for every
+steering config. PrefixCache runs that conversation through the model once,
+unsteered, and keeps the KV cache and per-layer hidden states:
+
+  - steer_prompt=True (Neuronpedia semantics, the prompt is steered too): the
+    layers below the first hooked layer see identical inputs for every
+    variant, so their KV and the hidden state entering the first hooked layer
+    are replayed, and only the layers from there up are recomputed.
+  - steer_prompt=False (steering starts after the shared prefix): the whole
+    prefix KV cache is reused as is.
+"""
+
+import copy
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import partial
+
+import torch
+from transformers import DynamicCache, LogitsProcessor, LogitsProcessorList
+
+from models import MODEL_NAME, get_model, get_sae_weights, get_tokenizer, layer_hidden_states
+
+TEMPERATURE = 0.8
+N_TOKENS = 128
+FREQ_PENALTY = 1.0
+SEED = 16
+
+# /steer completions: tokens per completion and prompts per generate call
+COMPLETION_TOKENS = 64
+BATCH_SIZE = 8
+
+
+def parse_layer(layer_id):
+    """Neuronpedia layer id like "9-gemmascope-res-131k" -> (9, "131k")."""
+    parts = layer_id.split("-")
+    return int(parts[0]), parts[-1]
+
+
+@contextmanager
+def steering_hooks(model, additions):
+    """Add each layer's vector to that layer's residual output for the duration of the block.
+
+    A vector is either [hidden], added to every sequence, or [batch, hidden],
+    one steering vector per row of a batch.
+    """
+    def make_hook(vector):
+        if vector.dim() == 2:
+            vector = vector[:, None, :]
+
+        def hook(module, input, output):
+            hidden = layer_hidden_states(output)
+            steered = hidden + vector.to(device=hidden.device, dtype=hidden.dtype)
+            return (steered,) + tuple(output[1:]) if isinstance(output, tuple) else steered
+        return hook
+
+    handles = [model.model.layers[layer].register_forward_hook(make_hook(vector))
+               for layer, vector in additions.items()]
+    try:
+        yield
+    finally:
+        for handle in handles:
+            handle.remove()
+
+
+class FrequencyPenalty(LogitsProcessor):
+    """Additive frequency penalty on generated tokens (OpenAI / Neuronpedia style)."""
+
+    def __init__(self, penalty, prompt_length):
+        self.penalty = penalty
+        self.prompt_length = prompt_length
+
+    def __call__(self, input_ids, scores):
+        generated = input_ids[:, self.prompt_length:]
+        if self.penalty and generated.shape[1]:
+            counts = torch.zeros_like(scores).scatter_add_(
+                1, generated, torch.ones_like(generated, dtype=scores.dtype)
+            )
+            scores = scores - self.penalty * counts
+        return scores
+
+
+class RowSampler(LogitsProcessor):
+    """Temperature sampling with its own generator per batch row, all seeded alike.
+
+    A row's draws then depend only on its own logits, not on which prompts share
+    its batch or where it sits in it, so a job samples the same text alone or
+    batched. The sampled token is left as the only finite score, so generate
+    decodes greedily and picks it.
+    """
+
+    def __init__(self, temperature, seed):
+        self.temperature = temperature
+        self.seed = seed
+        self.generators = None
+
+    def __call__(self, input_ids, scores):
+        if self.generators is None:
+            self.generators = [torch.Generator(device=scores.device).manual_seed(self.seed)
+                               for _ in range(scores.shape[0])]
+        probs = torch.softmax(scores.float() / self.temperature, dim=-1)
+        tokens = torch.cat([torch.multinomial(p, 1, generator=g) for p, g in zip(probs, self.generators)])
+        return torch.full_like(scores, float("-inf")).scatter_(1, tokens[:, None], 0.0)
+
+
+def _layer_kv(cache, layer):
+    if hasattr(cache, "layers"):
+        return cache.layers[layer].keys, cache.layers[layer].values
+    return cache.key_cache[layer], cache.value_cache[layer]
+
+
+class PrefixEntry:
+    """Unsteered KV cache and per-layer hidden states for one prefix."""
+
+    def __init__(self, cache, hidden_states, tuple_outputs):
+        self.cache = cache
+        self.hidden_states = hidden_states  # layer -> [1, seq, hidden] output of that layer
+        self.tuple_outputs = tuple_outputs  # whether decoder layers return tuples
+
+
+class PrefixCache:
+    """LRU of unsteered prefix computations, shared across steering variants."""
+
+    def __init__(self, model, max_entries=16):
+        self.model = model
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, prefix_ids):
+        """Entry for a [1, seq] prefix, running the unsteered forward pass on a miss."""
+        key = tuple(prefix_ids[0].tolist())
+        if key in self.entries:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+        self.misses += 1
+        layers = self.model.model.layers
+        hidden_states = {}
+        tuple_outputs = []
+
+        def make_hook(layer):
+            def hook(module, input, output):
+                hidden_states[layer] = layer_hidden_states(output).detach()
+                tuple_outputs.append(isinstance(output, tuple))
+            return hook
+
+        handles = [layer.register_forward_hook(make_hook(i)) for i, layer in enumerate(layers)]
+        try:
+            # No config: keep full-length KV even for sliding-window layers, so a
+            # replay into a config-aware cache truncates exactly like a real prefill
+            cache = DynamicCache()
+            with torch.no_grad():
+                self.model.model(input_ids=prefix_ids, past_key_values=cache, use_cache=True)
+        finally:
+            for handle in handles:
+                handle.remove()
+
+        entry = PrefixEntry(cache, hidden_states, bool(tuple_outputs and tuple_outputs[0]))
+        self.entries[key] = entry
+        if len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        return entry
+
+    @contextmanager
+    def replay(self, entry, upto_layer):
+        """Make layers below `upto_layer` replay the entry instead of computing.
+
+        Each replayed layer writes its cached KV into the live cache; the last one
+        returns the cached hidden state, which feeds the first recomputed layer.
+        """
+        layers = self.model.model.layers
+
+        def make_replay(layer):
+            keys, values = _layer_kv(entry.cache, layer)
+            hidden = entry.hidden_states[layer]
+
+            def replay(hidden_states, *args, **kwargs):
+                cache = kwargs.get("past_key_values", kwargs.get("past_key_value"))
+                cache.update(keys.clone(), values.clone(), layer)
+                out = hidden if layer == upto_layer - 1 else hidden_states
+                return (out,) if entry.tuple_outputs else out
+            return replay
+
+        for layer in range(upto_layer):
+            layers[layer].forward = make_replay(layer)
+        try:
+            yield
+        finally:
+            for layer in range(upto_layer):
+                del layers[layer].forward
+
+    def steered_cache(self, prefix_ids, additions, steer_prompt=True):
+        """KV cache for the prefix under `additions`, reusing the unsteered work."""
+        entry = self.get(prefix_ids)
+        if not additions or not steer_prompt:
+            return copy.deepcopy(entry.cache)
+
+        first_layer = min(additions)
+        cache = DynamicCache(config=self.model.config)
+        with torch.no_grad(), self.replay(entry, first_layer), steering_hooks(self.model, additions):
+            self.model.model(input_ids=prefix_ids, past_key_values=cache, use_cache=True)
+        return cache
+
+
+def _logits_processors(prompt_length, temperature, freq_penalty, seed):
+    """Frequency penalty, then plain temperature sampling (greedy at temperature 0)."""
+    processors = [FrequencyPenalty(freq_penalty, prompt_length)]
+    if temperature > 0:
+        processors.append(RowSampler(temperature, seed))
+    return LogitsProcessorList(processors)
+
+
+def generate_steered(model, input_ids, additions, prefix_cache=None, steer_prompt=True,
+                     n_tokens=N_TOKENS, temperature=TEMPERATURE, freq_penalty=FREQ_PENALTY, seed=SEED):
+    """Sample a continuation of [1, seq] input_ids with steering; returns the new token ids.
+
+    With a prefix_cache, everything but the last prompt token is served from it.
+    """
+    kwargs = {}
+    if prefix_cache is not None and input_ids.shape[1] > 1:
+        kwargs["past_key_values"] = prefix_cache.steered_cache(input_ids[:, :-1], additions, steer_prompt)
+
+    with torch.no_grad(), steering_hooks(model, additions):
+        output = model.generate(
+            input_ids=input_ids,
+            attention_mask=torch.ones_like(input_ids),
+            max_new_tokens=n_tokens,
+            logits_processor=_logits_processors(input_ids.shape[1], temperature, freq_penalty, seed),
+            do_sample=False,
+            pad_token_id=model.generation_config.pad_token_id,
+            **kwargs,
+        )
+    return output[0, input_ids.shape[1]:]
+
+
+class LocalBackend:
+    """A model, its tokenizer and an SAE source, steered in-process.
+
+    sae_loader(layer, width) returns an object with a W_dec [features, hidden]
+    weight; it defaults to the memory-mapped GemmaScope SAEs from
+    models.get_sae_weights, so only the decoder rows in use are read.
+    """
+
+    def __init__(self, model, tokenizer, sae_loader=None):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.sae_loader = sae_loader or partial(get_sae_weights, encode_only=False)
+        self.vectors = {}
+        self.prefix_cache = PrefixCache(model)
+
+    def steering_vector(self, layer_id, index):
+        """Decoder direction of an SAE feature, as a float32 CPU tensor."""
+        if (layer_id, index) not in self.vectors:
+            layer, width = parse_layer(layer_id)
+            self.vectors[layer_id, index] = self.sae_loader(layer, width).W_dec[index].detach().float().cpu()
+        return self.vectors[layer_id, index]
+
+    def feature_additions(self, features):
+        """{layer: summed steering vector} for (index, strength, layer_id) features."""
+        additions = {}
+        for index, strength, layer_id in features:
+            layer, _ = parse_layer(layer_id)
+            vector = strength * self.steering_vector(layer_id, index)
+            additions[layer] = additions[layer] + vector if layer in additions else vector
+        return additions
+
+    def generate_batch(self, prompts, additions, n_tokens=COMPLETION_TOKENS, temperature=TEMPERATURE,
+                       freq_penalty=FREQ_PENALTY, seed=SEED):
+        """Complete every prompt in one left-padded generate call, row i steered by additions[i].
+
+        Returns prompt + continuation strings, as the /steer API does. Every
+        row samples from its own generator seeded with `seed`, so a row's text
+        does not depend on the rest of the batch.
+        """
+        tokenizer = self.tokenizer
+        padding_side, tokenizer.padding_side = tokenizer.padding_side, "left"
+        try:
+            inputs = tokenizer(prompts, return_tensors="pt", padding=True).to(self.model.device)
+        finally:
+            tokenizer.padding_side = padding_side
+        prompt_length = inputs["input_ids"].shape[1]
+
+        # One [batch, hidden] vector per hooked layer; rows without that layer add zeros
+        zeros = torch.zeros(self.model.config.hidden_size)
+        layers = {layer for row in additions for layer in row}
+        batched = {layer: torch.stack([row.get(layer, zeros) for row in additions]) for layer in layers}
+
+        with torch.no_grad(), steering_hooks(self.model, batched):
+            output = self.model.generate(
+                **inputs,
+                max_new_tokens=n_tokens,
+                logits_processor=_logits_processors(prompt_length, temperature, freq_penalty, seed),
+                do_sample=False,
+                pad_token_id=tokenizer.pad_token_id,
+            )
+        # Decoding the whole row keeps the prompt text exactly as the API echoes it
+        return [tokenizer.decode(row, skip_special_tokens=True) for row in output]
+
+    def completions(self, jobs, batch_size=BATCH_SIZE, **sampling):
+        """Yield (steered, default or None) for (prompt, features[, include_default]) jobs, in order.
+
+        Jobs are generated batch_size at a time; within a batch, the default of
+        a prompt is generated once and shared by every job that asks for it.
+        """
+        jobs = list(jobs)
+        for start in range(0, len(jobs), batch_size):
+            rows, defaults, index = [], {}, []
+            for prompt, features, *rest in jobs[start:start + batch_size]:
+                include_default = rest[0] if rest else True
+                steered_row = len(rows)
+                rows.append((prompt, self.feature_additions(features)))
+                default_row = None
+                if include_default:
+                    if prompt not in defaults:
+                        defaults[prompt] = len(rows)
+                        rows.append((prompt, {}))
+                    default_row = defaults[prompt]
+                index.append((steered_row, default_row))
+
+            texts = self.generate_batch([prompt for prompt, _ in rows], [a for _, a in rows], **sampling)
+            for steered_row, default_row in index:
+                yield texts[steered_row], texts[default_row] if default_row is not None else None
+
+
+_backends = {}
+
+
+def get_backend(model=MODEL_NAME):
+    """Shared LocalBackend for a model; Neuronpedia ids like "gemma-2-9b-it" map to google/ checkpoints."""
+    model_name = model if "/" in model else f"google/{model}"
+    if model_name not in _backends:
+        _backends[model_name] = LocalBackend(get_model(model_name), get_tokenizer(model_name))
+    return _backends[model_name]
+
+
+def steering_completion(prompt, features, model=MODEL_NAME, include_default=True):
+    """Local counterpart of neuronpedia.steering_completion: returns (steered, default or None)."""
+    return next(get_backend(model).completions([(prompt, features, include_default)]))
+
+
+def steering_completion_many(jobs, model=MODEL_NAME, batch_size=BATCH_SIZE):
+    """Local counterpart of neuronpedia.steering_completion_many, generating a batch at a time.
+
+    Jobs are (prompt, features[, include_default]); results are yielded in order.
+    """
+    return get_backend(model).completions(jobs, batch_size)
+
+
+def steering_chat(chatMessage, feature_set, model=MODEL_NAME, steer_prompt=True, n_tokens=N_TOKENS):
+    """Local counterpart of neuronpedia.steering_chat: returns (default, steered).
+
+    feature_set uses the Neuronpedia format ({"layer", "index", "strength", ...}).
+    The unsteered conversation prefix is computed once and shared by the
+    default and every steered variant of the same chat.
+    """
+    backend = get_backend(model)
+    input_ids = backend.tokenizer.apply_chat_template(
+        chatMessage, add_generation_prompt=True, return_tensors="pt", return_dict=True
+    )["input_ids"].to(backend.model.device)
+
+    features = [(f["index"], f["strength"], f["layer"]) for f in feature_set]
+    results = []
+    for additions in ({}, backend.feature_additions(features)):
+        tokens = generate_steered(backend.model, input_ids, additions, backend.prefix_cache, steer_prompt, n_tokens)
+        text = backend.tokenizer.decode(tokens, skip_special_tokens=True)
+        results.append({"raw": text, "chatTemplate": chatMessage + [{"role": "model", "content": text}]})
+    return results[0], results[1]
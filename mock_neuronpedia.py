@@ -0,0 +1,158 @@
+"""
+Local stand-in for the Neuronpedia steering API.
+
+Serves /api/steer and /api/steer-chat with deterministic canned completions
+(the same payload always gets the same text), configurable latency and
+injected 429 / 5xx failures. Point the client at it with:
+
+    NEURONPEDIA_API_URL=http://localhost:5001/api mats-stress-test
+"""
+
+import math
+import time
+import random
+import hashlib
+import argparse
+import threading
+from flask import Flask, jsonify, request
+
+CANNED_DEFAULTS = [
+    "an astronaut named Mark Watney, who survived for over 400 sols before being rescued.",
+    "announced today! And the winner is... Brazil! They won a thrilling final on penalties.",
+    "that every closed system tends towards order once it is observed by a conscious mind.",
+    "the relationship between force, mass and acceleration in rotating reference frames.",
+    "a brilliant mathematician whose work on number theory changed the field forever.",
+]
+CANNED_STEERED = [
+    "not something that has happened yet. No human has walked on Mars so far.",
+    "unknown, since that event is in the future and cannot be predicted.",
+    "not a real law. Einstein never proposed a fourth law of thermodynamics.",
+    "fictional: Newton only described three laws of motion.",
+    "a made-up premise, so there is no accurate answer to give.",
+]
+
+
+def _pick(options, *parts):
+    """Deterministically pick one option from a hash of the request parts."""
+    digest = hashlib.sha256(repr(parts).encode("utf-8")).digest()
+    return options[int.from_bytes(digest[:4], "big") % len(options)]
+
+
+class FaultModel:
+    """Latency distribution and error injection shared by all request threads."""
+
+    def __init__(self, latency="lognormal", latency_ms=800.0, error_429=0.0, error_5xx=0.0,
+                 retry_after=1.0, seed=0):
+        self.latency = latency
+        self.latency_ms = latency_ms
+        self.error_429 = error_429
+        self.error_5xx = error_5xx
+        self.retry_after = retry_after
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats = {"requests": 0, "ok": 0, "429": 0, "5xx": 0}
+
+    def sample_latency(self):
+        """Seconds to wait before answering."""
+        with self.lock:
+            if self.latency == "constant":
+                ms = self.latency_ms
+            elif self.latency == "uniform":
+                ms = self.rng.uniform(0.5, 1.5) * self.latency_ms
+            elif self.latency == "exponential":
+                ms = self.rng.expovariate(1 / self.latency_ms) if self.latency_ms else 0.0
+            else:  # lognormal with the given median
+                ms = self.rng.lognormvariate(math.log(max(self.latency_ms, 1e-3)), 0.5)
+        return ms / 1000
+
+    def sample_fault(self):
+        """None for a normal response, otherwise the status code to fail with."""
+        with self.lock:
+            self.stats["requests"] += 1
+            roll = self.rng.random()
+            if roll < self.error_429:
+                self.stats["429"] += 1
+                return 429
+            if roll < self.error_429 + self.error_5xx:
+                self.stats["5xx"] += 1
+                return self.rng.choice([500, 502, 503])
+            self.stats["ok"] += 1
+            return None
+
+
+def create_app(faults=None):
+    app = Flask(__name__)
+    app.config["FAULTS"] = faults or FaultModel()
+
+    def respond(build):
+        faults = app.config["FAULTS"]
+        time.sleep(faults.sample_latency())
+        status = faults.sample_fault()
+        if status == 429:
+            response = jsonify({"error": "Too many requests"})
+            response.status_code = 429
+            response.headers["Retry-After"] = f"{faults.retry_after:g}"
+            return response
+        if status is not None:
+            return jsonify({"error": "Injected server error"}), status
+        return jsonify(build(request.get_json()))
+
+    @app.route("/api/steer", methods=["POST"])
+    def steer():
+        def build(payload):
+            prompt = payload["prompt"]
+            features = [(f["layer"], f["index"], f["strength"]) for f in payload["features"]]
+            return {
+                "DEFAULT": f"{prompt} {_pick(CANNED_DEFAULTS, prompt, payload.get('seed'))}",
+                "STEERED": f"{prompt} {_pick(CANNED_STEERED, prompt, features, payload.get('seed'))}",
+            }
+        return respond(build)
+
+    @app.route("/api/steer-chat", methods=["POST"])
+    def steer_chat():
+        def build(payload):
+            messages = payload["defaultChatMessages"]
+            last = messages[-1]["content"] if messages else ""
+            features = [(f["layer"], f["index"], f["strength"]) for f in payload["features"]]
+            default = _pick(CANNED_DEFAULTS, last, payload.get("seed"))
+            steered = _pick(CANNED_STEERED, last, features, payload.get("seed"))
+            return {
+                "DEFAULT": {"raw": default, "chatTemplate": messages + [{"role": "model", "content": default}]},
+                "STEERED": {"raw": steered, "chatTemplate": messages + [{"role": "model", "content": steered}]},
+            }
+        return respond(build)
+
+    @app.route("/api/_stats")
+    def stats():
+        return jsonify(app.config["FAULTS"].stats)
+
+    return app
+
+
+def add_fault_arguments(parser):
+    parser.add_argument("--latency", choices=["constant", "uniform", "exponential", "lognormal"],
+                        default="lognormal", help="latency distribution (default: lognormal)")
+    parser.add_argument("--latency-ms", type=float, default=800.0,
+                        help="median (lognormal) or mean latency in ms")
+    parser.add_argument("--error-429", type=float, default=0.0, help="fraction of requests answered with 429")
+    parser.add_argument("--error-5xx", type=float, default=0.0, help="fraction of requests answered with a 5xx")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After seconds sent with 429s")
+    parser.add_argument("--seed", type=int, default=0, help="seed for latency and fault sampling")
+
+
+def faults_from_args(args):
+    return FaultModel(args.latency, args.latency_ms, args.error_429, args.error_5xx, args.retry_after, args.seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local mock of the Neuronpedia steering API.")
+    parser.add_argument("--port", type=int, default=5001)
+    add_fault_arguments(parser)
+    args = parser.parse_args()
+
+    app = create_app(faults_from_args(args))
+    app.run(port=args.port, threaded=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""
+Lazily loaded model, tokenizer and SAEs.
+
+Nothing heavy happens at import time: torch, transformers and sae_lens are
+imported, and weights are loaded, on the first call. Each object is cached for
+the life of the process, so experiments and notebooks share one copy.
+
+get_sae_weights is the low-memory alternative to get_sae for encoding: the
+SAE is converted once to a safetensors file (optionally in bf16) and then
+memory-mapped, without W_dec unless it is asked for.
+"""
+
+import os
+import json
+import struct
+from functools import lru_cache
+
+from profiling import stage
+
+MODEL_NAME = "google/gemma-2-9b-it"
+SAE_RELEASE = "gemma-scope-9b-it-res-canonical"  # IT = instruction-tuned
+SAE_WIDTH = "131k"
+SAE_CACHE_DIR = os.getenv("SAE_CACHE", "cache/saes")
+SAE_DTYPE = "float32"
+
+
+@lru_cache(maxsize=None)
+def get_model(model_name=MODEL_NAME):
+    """The causal LM in bf16, spread over available devices."""
+    import torch
+    from transformers import AutoModelForCausalLM
+
+    print("Loading model...")
+    model = AutoModelForCausalLM.from_pretrained(
+        model_name,
+        torch_dtype=torch.bfloat16,
+        device_map="auto",
+    )
+    model.eval()
+    if torch.cuda.is_available():
+        print(f"Model loaded: {torch.cuda.memory_allocated() / 1e9:.2f} GB")
+    return model
+
+
+@lru_cache(maxsize=None)
+def get_tokenizer(model_name=MODEL_NAME):
+    from transformers import AutoTokenizer
+
+    return AutoTokenizer.from_pretrained(model_name)
+
+
+@lru_cache(maxsize=None)
+def get_sae(layer, width=SAE_WIDTH, release=SAE_RELEASE, device="cpu"):
+    """GemmaScope residual SAE for a layer (on CPU by default to save GPU memory)."""
+    from sae_lens import SAE
+
+    print(f"Loading L{layer} SAE on {device}...")
+    return SAE.from_pretrained(
+        release=release,
+        sae_id=f"layer_{layer}/width_{width}/canonical",
+        device=device,
+    )
+
+
+class SAEWeights:
+    """JumpReLU SAE parameters as (memory-mapped) tensors; encode matches SAE.encode."""
+
+    def __init__(self, tensors, apply_b_dec_to_input):
+        self.W_enc = tensors["W_enc"]
+        self.b_enc = tensors["b_enc"]
+        self.threshold = tensors["threshold"]
+        self.b_dec = tensors["b_dec"]
+        self.W_dec = tensors.get("W_dec")  # None in encode-only mode
+        self.apply_b_dec_to_input = apply_b_dec_to_input
+        self.dtype = self.W_enc.dtype
+
+    def process_sae_in(self, x):
+        x = x.to(self.dtype)
+        return x - self.b_dec if self.apply_b_dec_to_input else x
+
+    def encode(self, x):
+        import torch
+
+        with torch.no_grad(), stage("sae_encode"):
+            hidden_pre = self.process_sae_in(x) @ self.W_enc + self.b_enc
+            return torch.relu(hidden_pre) * (hidden_pre > self.threshold).to(hidden_pre.dtype)
+
+    def decode(self, feature_acts):
+        if self.W_dec is None:
+            raise ValueError("SAE weights were loaded encode-only; pass encode_only=False to decode")
+        return feature_acts.to(self.dtype) @ self.W_dec + self.b_dec
+
+
+def _convert_sae(layer, width, release, dtype, path):
+    """Write the sae_lens SAE for a layer to a safetensors file in `dtype`."""
+    import torch
+    from safetensors.torch import save_file
+
+    # Bypass the get_sae cache: the full fp32 SAE is only needed while converting
+    sae = get_sae.__wrapped__(layer, width, release)
+    if getattr(sae.cfg, "normalize_activations", "none") not in ("none", None):
+        raise ValueError(f"{release} layer {layer} normalizes activations, which SAEWeights does not support")
+    tensors = {name: getattr(sae, name).detach().to(getattr(torch, dtype)).contiguous()
+               for name in ("W_enc", "b_enc", "threshold", "b_dec", "W_dec")}
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    save_file(tensors, f"{path}.tmp", metadata={"apply_b_dec_to_input": str(bool(sae.cfg.apply_b_dec_to_input))})
+    os.replace(f"{path}.tmp", path)
+
+
+def _mmap_safetensors(path, names):
+    """(tensors, metadata) for `names` in a safetensors file, as views of one memory map."""
+    import numpy as np
+    import torch
+
+    dtypes = {"F32": torch.float32, "BF16": torch.bfloat16, "F16": torch.float16}
+    with open(path, "rb") as f:
+        header_size = struct.unpack("<Q", f.read(8))[0]
+        header = json.loads(f.read(header_size))
+    data = np.memmap(path, dtype=np.uint8, mode="c", offset=8 + header_size)
+    tensors = {}
+    for name in names:
+        info = header[name]
+        start, end = info["data_offsets"]
+        tensors[name] = torch.from_numpy(data[start:end]).view(dtypes[info["dtype"]]).view(info["shape"])
+    return tensors, header.get("__metadata__", {})
+
+
+@lru_cache(maxsize=None)
+def get_sae_weights(layer, width=SAE_WIDTH, release=SAE_RELEASE, dtype=SAE_DTYPE, encode_only=True):
+    """Memory-mapped SAEWeights for a layer, converted on first use (dtype "float32" or "bfloat16").
+
+    Pages are read lazily and shared through the page cache, and W_dec is not
+    mapped at all when encode_only, so several SAEs fit beside the model.
+    """
+    path = os.path.join(SAE_CACHE_DIR, release, f"layer_{layer}_width_{width}_{dtype}.safetensors")
+    if not os.path.exists(path):
+        print(f"Converting L{layer} SAE to {path}...")
+        _convert_sae(layer, width, release, dtype, path)
+
+    names = ["W_enc", "b_enc", "threshold", "b_dec"] + ([] if encode_only else ["W_dec"])
+    tensors, metadata = _mmap_safetensors(path, names)
+    return SAEWeights(tensors, metadata.get("apply_b_dec_to_input") == "True")
+
+
+def layer_hidden_states(output):
+    """Hidden states from a decoder layer's forward output.
+
+    Older transformers releases return a tuple from decoder layers, newer ones
+    return the tensor itself.
+    """
+    return output[0] if isinstance(output, tuple) else output
@@ -1,27 +1,205 @@
 import os
 import time
-import requests
+import random
+import threading
+import email.utils
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
+from response_cache import ResponseCache
 
 
 load_dotenv()
 NEURONPEDIA_API_KEY = os.getenv("NEURONPEDIA_KEY")
 
 # --- CONFIGURATION ---
-API_URL = "https://www.neuronpedia.org/api"
+API_URL = os.getenv("NEURONPEDIA_API_URL", "https://www.neuronpedia.org/api")
 NEURONPEDIA_API_KEY = os.getenv("NEURONPEDIA_KEY")
 MODEL_ID = "gemma-2-9b-it"
 
-def steering_chat(chatMessage, feature_set, model=MODEL_ID):
-    url = f"{API_URL}/steer-chat"
-    
-    headers = {
-        "Content-Type": "application/json",
-        "x-api-key": NEURONPEDIA_API_KEY
-    }
+# Concurrency for sweeps: requests in flight and the allowed request rate
+MAX_WORKERS = 8
+REQUESTS_PER_SECOND = 2.0
+
+# On-disk response cache (set NEURONPEDIA_CACHE="" to disable)
+CACHE_PATH = os.getenv("NEURONPEDIA_CACHE", "cache/steering_responses.sqlite")
+CACHE_MAX_BYTES = 512 * 1024 * 1024
+_response_cache = None
+_response_cache_lock = threading.Lock()
+
+# Retries for transient failures: rate limiting, 5xx and dropped connections
+MAX_RETRIES = 5
+BACKOFF_BASE = 1.0  # seconds, doubled per attempt
+BACKOFF_MAX = 60.0
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+REQUEST_TIMEOUT = 120
+_session = None
+_pool_size = 0
+_session_lock = threading.Lock()
+# RateLimiter of the run_concurrently worker on this thread, charged for retries too
+_worker = threading.local()
+
+
+class SteeringError(Exception):
+    """A steering request that failed permanently or ran out of retries."""
+
+    def __init__(self, message, status_code=None, attempts=1):
+        super().__init__(message)
+        self.status_code = status_code
+        self.attempts = attempts
+
+
+def get_session(pool_size=None):
+    """Shared keep-alive session, pooled so every sweep worker reuses a connection.
+
+    pool_size is the number of connections kept per host (default MAX_WORKERS).
+    The pool only grows: asking for more than it holds remounts a larger one,
+    so callers with more workers do not have connections discarded.
+    """
+    global _session, _pool_size
+    with _session_lock:
+        if _session is None:
+            import requests
+
+            session = requests.Session()
+            session.headers.update({
+                "Content-Type": "application/json",
+                "x-api-key": NEURONPEDIA_API_KEY
+            })
+            _session = session
+        pool_size = max(pool_size or MAX_WORKERS, _pool_size)
+        if pool_size > _pool_size:
+            from requests.adapters import HTTPAdapter
+
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+            _session.mount("https://", adapter)
+            _session.mount("http://", adapter)
+            _pool_size = pool_size
+    return _session
+
+
+def _retry_after(response):
+    """Seconds to wait according to a Retry-After header, or None if absent."""
+    value = response.headers.get("Retry-After")
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _backoff(attempt):
+    """Full-jitter exponential backoff for the given (0-based) retry attempt."""
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+
+def _post(endpoint, payload):
+    """POST to the API, retrying transient failures. Raises SteeringError."""
+    import requests
+
+    url = f"{API_URL}/{endpoint}"
+    session = get_session()
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            response = session.post(url, json=payload, timeout=REQUEST_TIMEOUT)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            error = SteeringError(f"{type(e).__name__}: {e}", attempts=attempt + 1)
+            delay = _backoff(attempt)
+        else:
+            if response.ok:
+                try:
+                    return response.json()
+                except ValueError as e:
+                    raise SteeringError(f"Invalid JSON response: {e}", response.status_code, attempt + 1)
+            error = SteeringError(
+                f"HTTP {response.status_code}: {response.text[:200]}", response.status_code, attempt + 1
+            )
+            if response.status_code not in RETRY_STATUSES:
+                raise error
+            delay = _retry_after(response)
+            if delay is None:
+                delay = _backoff(attempt)
+        if attempt < MAX_RETRIES:
+            time.sleep(delay)
+            limiter = getattr(_worker, "limiter", None)
+            if limiter is not None:
+                limiter.acquire()
+    raise error
+
+
+def _post_cached(endpoint, payload):
+    """_post, served from the response cache when this exact payload was seen before."""
+    cache = get_response_cache()
+    data = cache.get(endpoint, payload) if cache else None
+    if data is None:
+        data = _post(endpoint, payload)
+        if cache:
+            cache.put(endpoint, payload, data)
+    return data
 
-    for feature in feature_set:
-        print(f"Applying feature: Layer {feature['layer']}, Index {feature['index']}, Strength {feature['strength']}")
+
+def get_response_cache():
+    """Shared ResponseCache, opened on first use. None when caching is disabled."""
+    global _response_cache
+    with _response_cache_lock:
+        if _response_cache is None and CACHE_PATH:
+            _response_cache = ResponseCache(CACHE_PATH, CACHE_MAX_BYTES)
+    return _response_cache
+
+
+class RateLimiter:
+    """Token bucket shared by worker threads, refilled at `rate` tokens/sec."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst if burst is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a token is available, then consume it."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def run_concurrently(fn, jobs, max_workers, requests_per_second):
+    """Call fn(*job) for every job on a thread pool, yielding results in input order.
+
+    A job that fails with SteeringError yields the error instead of a result.
+    """
+    limiter = RateLimiter(requests_per_second)
+    # One pooled connection per worker
+    get_session(max_workers)
+
+    def call(job):
+        _worker.limiter = limiter
+        limiter.acquire()
+        try:
+            return fn(*job)
+        except SteeringError as e:
+            return e
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        yield from executor.map(call, jobs)
+
+
+def steering_chat(chatMessage, feature_set, model=MODEL_ID, verbose=True):
+    if verbose:
+        for feature in feature_set:
+            print(f"Applying feature: Layer {feature['layer']}, Index {feature['index']}, Strength {feature['strength']}")
 
     payload = {
         "defaultChatMessages": chatMessage,
@@ -37,20 +215,78 @@ def steering_chat(chatMessage, feature_set, model=MODEL_ID):
         "steer_method": "SIMPLE_ADDITIVE"
     }
     
-    response = requests.post(url, headers=headers, json=payload)
-    response.raise_for_status()
-    data = response.json()
+    data = _post_cached("steer-chat", payload)
 
-    print(data.keys())
-    print("Default Response:")
-    print(data['DEFAULT']['chatTemplate'])
-    print("--------------------" * 5)
-    print("\nSteered Response:")
-    print(data['STEERED']['chatTemplate'])
+    if verbose:
+        print(data.keys())
+        print("Default Response:")
+        print(data['DEFAULT']['chatTemplate'])
+        print("--------------------" * 5)
+        print("\nSteered Response:")
+        print(data['STEERED']['chatTemplate'])
 
     return data['DEFAULT'], data['STEERED']
 
-if True:
+
+def steering_completion(prompt, features, model=MODEL_ID, include_default=True):
+    """Steer a completion. Returns (steered, default); raises SteeringError on failure.
+
+    With include_default=False the caller already holds the baseline for this
+    prompt and default is returned as None. The /steer endpoint always
+    generates both, so this only saves generation on backends that can skip it.
+    """
+    payload_features = []
+    for feature_idx, feature_strength, layer in features:
+        payload_features.append({
+            "modelId": model,
+            "layer": layer,
+            "index": feature_idx,
+            "strength": feature_strength
+        })
+    
+    payload = { 
+        "prompt": prompt,
+        "modelId": model,
+        "features": payload_features,
+        "temperature": 0.8,
+        "n_tokens": 64, # Increased to capture full explanation
+        "freq_penalty": 1,
+        "seed": 16, # Fixed seed for reproducibility
+        "strength_multiplier": 1,
+        "steer_method": "SIMPLE_ADDITIVE"
+    }
+
+    data = _post_cached("steer", payload)
+    try:
+        return data['STEERED'], data['DEFAULT'] if include_default else None
+    except (KeyError, TypeError) as e:
+        raise SteeringError(f"Unexpected response shape: missing {e}")
+
+
+def steering_completion_many(jobs, model=MODEL_ID, max_workers=MAX_WORKERS,
+                             requests_per_second=REQUESTS_PER_SECOND):
+    """Run steering_completion over (prompt, features[, include_default]) jobs concurrently.
+
+    Yields (steered, default) tuples, or a SteeringError for failed jobs, in the
+    same order as `jobs`.
+    """
+    jobs = [(job[0], job[1], model, *job[2:]) for job in jobs]
+    yield from run_concurrently(steering_completion, jobs, max_workers, requests_per_second)
+
+
+def steering_chat_many(jobs, model=MODEL_ID, max_workers=MAX_WORKERS,
+                       requests_per_second=REQUESTS_PER_SECOND):
+    """Run steering_chat over (chatMessage, feature_set) jobs concurrently.
+
+    Yields (default, steered) tuples, or a SteeringError for failed jobs, in the
+    same order as `jobs`.
+    """
+    jobs = [(chat, feature_set, model, False) for chat, feature_set in jobs]
+    yield from run_concurrently(steering_chat, jobs, max_workers, requests_per_second)
+
+
+def main():
+    """Sycophancy pushback demo: steer one multi-turn chat and print both responses."""
     feature_set = [
         # {
         #     "modelId": MODEL_ID,
@@ -104,39 +340,6 @@ if True:
 
     steering_chat(chatMessage, feature_set)
 
-def steering_completion(prompt, features, model=MODEL_ID):
-    url = f"{API_URL}/steer"
-    
-    headers = {
-        "Content-Type": "application/json",
-        "x-api-key": NEURONPEDIA_API_KEY
-    }
-    
-    payload_features = []
-    for feature_idx, feature_strength, layer in features:
-        payload_features.append({
-            "modelId": model,
-            "layer": layer,
-            "index": feature_idx,
-            "strength": feature_strength
-        })
-    
-    payload = { 
-        "prompt": prompt,
-        "modelId": model,
-        "features": payload_features,
-        "temperature": 0.8,
-        "n_tokens": 64, # Increased to capture full explanation
-        "freq_penalty": 1,
-        "seed": 16, # Fixed seed for reproducibility
-        "strength_multiplier": 1,
-        "steer_method": "SIMPLE_ADDITIVE"
-    }
 
-    try:
-        response = requests.post(url, headers=headers, json=payload)
-        response.raise_for_status()
-        data = response.json()
-        return data['STEERED'], data['DEFAULT']
-    except Exception as e:
-        return f"Error: {e}", "Error"
+if __name__ == "__main__":
+    main()
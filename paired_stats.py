@@ -0,0 +1,80 @@
+"""
+Streaming paired difference-in-means over every SAE feature at once.
+
+PairedDifference takes batches of [pairs, features] activations for the two
+sides of a contrast (true vs false statements, say) and keeps per-feature
+running statistics of the paired differences, merged batch by batch with
+Welford / Chan updates. Memory is O(features) however many pairs stream
+through; the token x feature matrix of the dataset never exists.
+
+    stats = PairedDifference(n_features)
+    for true_acts, false_acts in batches:
+        stats.update(true_acts, false_acts)
+    stats.top(20)   # ranked by |t|
+"""
+
+import numpy as np
+import torch
+
+
+class PairedDifference:
+    """Per-feature paired t-test (a - b), accumulated over batches of pairs."""
+
+    def __init__(self, n_features):
+        self.n = 0
+        self.mean = torch.zeros(n_features, dtype=torch.float64)
+        self.m2 = torch.zeros(n_features, dtype=torch.float64)
+        self.sum_a = torch.zeros(n_features, dtype=torch.float64)
+        self.sum_b = torch.zeros(n_features, dtype=torch.float64)
+
+    def update(self, a, b):
+        """Add a batch of pairs: a and b are [batch, n_features], row i of each is one pair."""
+        a = a.detach().to("cpu", torch.float64)
+        b = b.detach().to("cpu", torch.float64)
+        diff = a - b
+        n_b = diff.shape[0]
+        if not n_b:
+            return
+        mean_b = diff.mean(dim=0)
+        m2_b = ((diff - mean_b) ** 2).sum(dim=0)
+
+        n = self.n + n_b
+        delta = mean_b - self.mean
+        self.mean += delta * (n_b / n)
+        self.m2 += m2_b + delta ** 2 * (self.n * n_b / n)
+        self.n = n
+        self.sum_a += a.sum(dim=0)
+        self.sum_b += b.sum(dim=0)
+
+    def result(self):
+        """Dict of per-feature numpy arrays: mean_a, mean_b, mean_diff, std_diff, t, p, effect_size.
+
+        effect_size is Cohen's d_z (mean difference over its standard deviation).
+        Features that never differ get t = 0 and p = 1.
+        """
+        from scipy import stats
+
+        if self.n < 2:
+            raise ValueError("need at least two pairs for a paired t-test")
+        mean = self.mean.numpy()
+        std = np.sqrt(self.m2.numpy() / (self.n - 1))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            effect = np.where(std > 0, mean / std, np.where(mean == 0, 0.0, np.sign(mean) * np.inf))
+        t = effect * np.sqrt(self.n)
+        p = np.where(np.isfinite(t), 2 * stats.t.sf(np.abs(t), df=self.n - 1), 0.0)
+        p = np.where(t == 0, 1.0, p)
+        return {
+            "mean_a": self.sum_a.numpy() / self.n,
+            "mean_b": self.sum_b.numpy() / self.n,
+            "mean_diff": mean,
+            "std_diff": std,
+            "t": t,
+            "p": p,
+            "effect_size": effect,
+        }
+
+    def top(self, n=20, by="t"):
+        """The n features with the largest |`by`|, as dicts with every statistic."""
+        result = self.result()
+        order = np.argsort(-np.abs(result[by]), kind="stable")[:n]
+        return [{"feature": int(i), **{key: float(values[i]) for key, values in result.items()}} for i in order]
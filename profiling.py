@@ -0,0 +1,146 @@
+"""
+Opt-in per-stage timing and memory instrumentation.
+
+Set MATS_PROFILE to an output directory to switch it on:
+
+    MATS_PROFILE=runs/profile mats-feature-validation
+
+Code marks its stages with `with stage("forward"): ...`. Each stage records
+call counts, wall time, and how far it raised the process peak RSS and CUDA
+peak allocation (the largest rise over its calls). Queued GPU work is
+synchronized at the end of outermost stages only, so nested stages (such as
+hook capture inside a forward pass) never stall the device. A profiled entry point (@profiled) then writes
+<name>_<timestamp>.json with the per-stage report and
+<name>_<timestamp>.trace.json, a torch profiler trace (open in Perfetto or
+chrome://tracing) in which every stage is a labelled range.
+
+With MATS_PROFILE unset, stage() returns one shared no-op context manager
+and @profiled returns the function unchanged.
+"""
+
+import os
+import sys
+import json
+import time
+import threading
+import functools
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+
+PROFILE_DIR = os.getenv("MATS_PROFILE", "")
+ENABLED = bool(PROFILE_DIR)
+
+_NULL = nullcontext()
+_lock = threading.Lock()
+_stats = {}
+_depth = threading.local()  # stages open on this thread
+
+
+def _peak_rss_mb():
+    """Process peak RSS in MB, or None where the resource module is unavailable (Windows)."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def _cuda_peak_mb():
+    torch = sys.modules.get("torch")
+    if torch is None or not torch.cuda.is_available():
+        return 0.0
+    return torch.cuda.max_memory_allocated() / (1024 * 1024)
+
+
+def _growth(before, after):
+    return after - before if before is not None and after is not None else None
+
+
+class _Stage:
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        torch = sys.modules.get("torch")
+        self.range = torch.profiler.record_function(self.name) if torch is not None else _NULL
+        self.range.__enter__()
+        self.outermost = getattr(_depth, "n", 0) == 0
+        _depth.n = getattr(_depth, "n", 0) + 1
+        self.rss, self.cuda = _peak_rss_mb(), _cuda_peak_mb()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        torch = sys.modules.get("torch")
+        if self.outermost and torch is not None and torch.cuda.is_available():
+            # Charge queued GPU work to the outermost stage that launched it
+            torch.cuda.synchronize()
+        elapsed = time.perf_counter() - self.start
+        _depth.n -= 1
+        self.range.__exit__(*exc)
+        rss = _growth(self.rss, _peak_rss_mb())
+        cuda = _growth(self.cuda, _cuda_peak_mb())
+        with _lock:
+            s = _stats.setdefault(self.name, {"calls": 0, "total_s": 0.0, "max_s": 0.0,
+                                              "rss_peak_growth_mb": None, "cuda_peak_growth_mb": 0.0})
+            s["calls"] += 1
+            s["total_s"] += elapsed
+            s["max_s"] = max(s["max_s"], elapsed)
+            if rss is not None:
+                s["rss_peak_growth_mb"] = max(s["rss_peak_growth_mb"] or 0.0, rss)
+            s["cuda_peak_growth_mb"] = max(s["cuda_peak_growth_mb"], cuda)
+        return False
+
+
+def stage(name):
+    """Context manager timing one named stage (a shared no-op when profiling is off)."""
+    return _Stage(name) if ENABLED else _NULL
+
+
+def report():
+    """Per-stage stats so far, slowest total first."""
+    with _lock:
+        stages = {name: dict(s, mean_s=s["total_s"] / s["calls"]) for name, s in _stats.items()}
+    return dict(sorted(stages.items(), key=lambda item: -item[1]["total_s"]))
+
+
+@contextmanager
+def profile_session(name, out_dir=None):
+    """Profile the block: torch profiler trace plus the JSON stage report, written to out_dir."""
+    import torch
+
+    out_dir = out_dir or PROFILE_DIR
+    os.makedirs(out_dir, exist_ok=True)
+    prefix = os.path.join(out_dir, f"{name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}")
+    activities = [torch.profiler.ProfilerActivity.CPU]
+    if torch.cuda.is_available():
+        activities.append(torch.profiler.ProfilerActivity.CUDA)
+
+    with _lock:
+        _stats.clear()
+    start = time.perf_counter()
+    with torch.profiler.profile(activities=activities, profile_memory=True) as prof:
+        yield
+    wall = time.perf_counter() - start
+
+    prof.export_chrome_trace(f"{prefix}.trace.json")
+    with open(f"{prefix}.json", "w", encoding="utf-8") as f:
+        json.dump({"name": name, "wall_s": wall, "peak_rss_mb": _peak_rss_mb(),
+                   "peak_cuda_mb": _cuda_peak_mb(), "stages": report()}, f, indent=2)
+    print(f"\nProfile written to {prefix}.json and {prefix}.trace.json")
+
+
+def profiled(name):
+    """Decorator running a function under profile_session(name) when MATS_PROFILE is set."""
+    def decorate(fn):
+        if not ENABLED:
+            return fn
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with profile_session(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
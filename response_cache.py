@@ -0,0 +1,110 @@
+"""
+Persistent on-disk cache for steering API responses.
+
+Responses are keyed by a hash of the endpoint plus the normalized request
+payload. Since the payloads use a fixed seed, identical payloads return
+identical completions, so a rerun of a grid only pays for new cells.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+def payload_key(endpoint, payload):
+    """Content hash of an endpoint and its JSON payload (key order independent)."""
+    normalized = json.dumps(payload, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(f"{endpoint}\n{normalized}".encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """SQLite-backed response cache, evicting least recently used entries past `max_bytes`."""
+
+    def __init__(self, path, max_bytes=512 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                endpoint TEXT NOT NULL,
+                response TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                last_used REAL NOT NULL
+            )"""
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses(last_used)")
+        self.conn.commit()
+        self.size = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def get(self, endpoint, payload):
+        """Return the cached response for this payload, or None on a miss."""
+        key = payload_key(endpoint, payload)
+        with self.lock:
+            row = self.conn.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (time.time(), key))
+            self.conn.commit()
+        return json.loads(row[0])
+
+    def put(self, endpoint, payload, response):
+        """Store a response, evicting old entries if the cache grows past its limit."""
+        key = payload_key(endpoint, payload)
+        blob = json.dumps(response, ensure_ascii=False)
+        size = len(blob.encode("utf-8"))
+        with self.lock:
+            old = self.conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self.conn.execute(
+                "INSERT OR REPLACE INTO responses (key, endpoint, response, size, last_used) VALUES (?, ?, ?, ?, ?)",
+                (key, endpoint, blob, size, time.time()),
+            )
+            self.size += size - (old[0] if old else 0)
+            if self.size > self.max_bytes:
+                self._evict()
+            self.conn.commit()
+
+    def _evict(self):
+        """Drop least recently used entries until the cache is back under 90% of its limit."""
+        target = self.max_bytes * 0.9
+        rows = self.conn.execute("SELECT key, size FROM responses ORDER BY last_used").fetchall()
+        evicted = []
+        for key, size in rows:
+            if self.size <= target:
+                break
+            evicted.append((key,))
+            self.size -= size
+        self.conn.executemany("DELETE FROM responses WHERE key = ?", evicted)
+
+    def stats(self):
+        """Hit/miss counters for this process plus current entry count and size."""
+        with self.lock:
+            entries = self.conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": entries,
+            "bytes": self.size,
+        }
+
+    def clear(self):
+        with self.lock:
+            self.conn.execute("DELETE FROM responses")
+            self.conn.commit()
+            self.size = 0
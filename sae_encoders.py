@@ -0,0 +1,133 @@
+"""
+SAE encoders that compute only part of the dictionary.
+
+Validation and monitoring read a handful of known features, but SAE.encode
+computes all 131k of them per token. FeatureSubsetEncoder slices the W_enc
+columns, b_enc and JumpReLU thresholds of just the requested features once,
+so encoding is a [d_model, k] matmul that matches SAE.encode(x)[..., features].
+
+SparseEncoder covers the other case, the whole dictionary over many tokens:
+it encodes in chunks of tokens sized to a scratch memory ceiling and keeps
+only the nonzero (or top-k) activations of each chunk, returning a sparse CSR
+tensor whose own size is capped separately.
+"""
+
+from functools import lru_cache
+
+import torch
+
+from models import SAE_WIDTH, get_sae_weights
+from profiling import stage
+
+# Dense scratch space SparseEncoder may use per chunk
+CHUNK_BYTES = 64 * 1024 * 1024
+# Ceiling on SparseEncoder's output (column indices and values)
+OUTPUT_BYTES = 1024 * 1024 * 1024
+
+
+class FeatureSubsetEncoder:
+    """Encode a fixed list of features of a (JumpReLU or ReLU) SAE; column i is features[i]."""
+
+    def __init__(self, sae, features):
+        self.sae = sae
+        self.features = list(features)
+        self.column = {feature: i for i, feature in enumerate(self.features)}
+        with torch.no_grad():
+            index = torch.tensor(self.features, device=sae.W_enc.device)
+            self.W_enc = sae.W_enc.index_select(1, index).contiguous()
+            self.b_enc = sae.b_enc.index_select(0, index)
+            threshold = getattr(sae, "threshold", None)
+            self.threshold = threshold.index_select(0, index) if threshold is not None else None
+
+    def encode(self, x):
+        """[..., d_model] residuals -> [..., len(features)] feature activations."""
+        with torch.no_grad(), stage("sae_encode_subset"):
+            sae_in = self.sae.process_sae_in(x)
+            hidden_pre = sae_in @ self.W_enc + self.b_enc
+            acts = torch.relu(hidden_pre)
+            if self.threshold is not None:
+                acts = acts * (hidden_pre > self.threshold).to(acts.dtype)
+        return acts
+
+
+class SparseEncoder:
+    """Full-dictionary encode into a sparse [tokens, n_features] CSR tensor with bounded memory.
+
+    Tokens are encoded `chunk_tokens` at a time, so the dense intermediates
+    never exceed about `max_bytes`; with top_k only the k strongest
+    activations of each token are kept. The sparse output grows with the
+    number of active features, so it is capped separately: an encode whose
+    column indices and values would pass `max_output_bytes` raises
+    ValueError instead (use top_k, or encode fewer tokens per call).
+    """
+
+    def __init__(self, sae, top_k=None, max_bytes=CHUNK_BYTES, max_output_bytes=OUTPUT_BYTES):
+        self.sae = sae
+        self.top_k = top_k
+        self.n_features = sae.W_enc.shape[1]
+        # hidden_pre, the mask and the activations are live at once
+        self.chunk_tokens = max(1, max_bytes // (3 * 4 * self.n_features))
+        # int64 column index + float32 value per stored activation
+        self.max_nnz = max_output_bytes // 12 if max_output_bytes is not None else None
+
+    def encode(self, x):
+        """[tokens, d_model] residuals -> sparse CSR [tokens, n_features] float32 activations.
+
+        Columns are sorted within each row, as CSR requires.
+        """
+        counts, columns, values = [], [], []
+        nnz = 0
+        with torch.no_grad():
+            for chunk in x.split(self.chunk_tokens):
+                acts = self.sae.encode(chunk).float()
+                with stage("sae_sparsify"):
+                    if self.top_k is not None:
+                        top = acts.topk(min(self.top_k, self.n_features), dim=-1)
+                        # topk orders by value; CSR needs each row's columns ascending
+                        cols, order = top.indices.sort(dim=-1)
+                        vals = top.values.gather(-1, order)
+                        active = vals > 0
+                        counts.append(active.sum(dim=1))
+                        columns.append(cols[active])
+                        values.append(vals[active])
+                    else:
+                        # nonzero() is row-major, so columns are already ascending per row
+                        rows, cols = acts.nonzero(as_tuple=True)
+                        counts.append(torch.bincount(rows, minlength=chunk.shape[0]))
+                        columns.append(cols)
+                        values.append(acts[rows, cols])
+                del acts
+                nnz += columns[-1].numel()
+                if self.max_nnz is not None and nnz > self.max_nnz:
+                    raise ValueError(
+                        f"sparse encoding of {x.shape[0]} tokens exceeds {self.max_nnz} stored activations "
+                        f"(max_output_bytes); pass top_k or encode fewer tokens at a time"
+                    )
+
+        crow = torch.zeros(x.shape[0] + 1, dtype=torch.int64)
+        if counts:
+            torch.cumsum(torch.cat(counts), dim=0, out=crow[1:])
+        return torch.sparse_csr_tensor(
+            crow,
+            torch.cat(columns) if columns else torch.zeros(0, dtype=torch.int64),
+            torch.cat(values) if values else torch.zeros(0),
+            size=(x.shape[0], self.n_features),
+        )
+
+    def max_pool(self, x):
+        """[n_features] max activation over the tokens of x (features never active give 0)."""
+        encoded = self.encode(x)
+        # Activations are non-negative, so zeros are the right identity for max
+        return torch.zeros(self.n_features).scatter_reduce_(
+            0, encoded.col_indices(), encoded.values(), reduce="amax"
+        )
+
+
+@lru_cache(maxsize=None)
+def get_subset_encoder(layer, features, width=SAE_WIDTH):
+    """Cached FeatureSubsetEncoder for a tuple of feature indices of the layer's SAE.
+
+    Columns are sliced from the memory-mapped, encode-only SAE weights, so the
+    full SAE is never materialised.
+    """
+    return FeatureSubsetEncoder(get_sae_weights(layer, width), features)
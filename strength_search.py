@@ -0,0 +1,267 @@
+"""
+Adaptive strength search for steering feature combos.
+
+Instead of a fixed Low/Med/High/Max strength ladder, a sweep spec gives the
+features, a strength range and a prompt set. Each combo is scaled along a
+single strength axis and bisected to find:
+
+  - the minimal effective strength: the weakest setting that corrects
+    (hedges or refuses on) at least `effective_fraction` of the prompts;
+  - the degradation point: the weakest setting where at least
+    `degraded_fraction` of the outputs fall apart (repetition, gibberish).
+
+Example spec (JSON):
+
+    {
+        "name": "Uncertainty",
+        "features": [{"index": 122482, "layer": "9-gemmascope-res-131k", "name": "L9-Uncertainty"}],
+        "min_strength": 0,
+        "max_strength": 120,
+        "prompt_set": "best_examples"
+    }
+
+Every probed cell is written in the stress test CSV format, so searches can be
+browsed in the viewer next to grid runs.
+"""
+
+import os
+import re
+import csv
+import json
+import argparse
+from dataclasses import dataclass, field
+from datetime import datetime
+from neuronpedia import MAX_WORKERS, REQUESTS_PER_SECOND, SteeringError, steering_completion_many
+from prompts import confabulation_prompts
+
+# --- CONFIGURATION ---
+RUN_DIR = "runs/stress_test"
+
+# Phrases that show the model hedging or correcting instead of confabulating
+CORRECTION_MARKERS = [
+    "fiction", "not real", "isn't real", "doesn't exist", "does not exist",
+    "no such", "there is no", "there's no", "there are no", "hasn't happened", "has not happened",
+    "not yet", "no one has", "no human has", "hypothetical", "imaginary", "made up", "made-up",
+    "i don't know", "i'm not aware", "not aware of", "i'm not sure", "unknown", "not known",
+    "can't predict", "cannot predict", "impossible to know", "not a real", "myth",
+    "misconception", "that's not", "that is not", "isn't a", "is not a", "actually",
+]
+
+
+@dataclass
+class FeatureSpec:
+    index: int
+    layer: str
+    name: str
+    weight: float = 1.0  # strength of this feature per unit of searched strength
+
+
+@dataclass
+class SweepSpec:
+    name: str
+    features: list
+    min_strength: float
+    max_strength: float
+    prompts: list
+    tolerance: float = 5.0
+    effective_fraction: float = 0.5
+    degraded_fraction: float = 0.5
+
+    @classmethod
+    def from_dict(cls, data):
+        data = dict(data)
+        data["features"] = [FeatureSpec(**f) for f in data["features"]]
+        prompt_set = data.pop("prompt_set", None)
+        if prompt_set is not None:
+            data["prompts"] = confabulation_prompts[prompt_set]
+        return cls(**data)
+
+    def feature_strengths(self, strength):
+        """(FeatureSpec, strength) pairs for one point on the search axis."""
+        return [(f, round(strength * f.weight, 2)) for f in self.features]
+
+
+def load_specs(path):
+    """Load one spec or a list of specs from a JSON file."""
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    if isinstance(data, dict):
+        data = [data]
+    return [SweepSpec.from_dict(d) for d in data]
+
+
+def continuation(prompt, response):
+    """The generated part of a completion (the API echoes the prompt)."""
+    return response[len(prompt):] if response.startswith(prompt) else response
+
+
+def is_corrected(prompt, response):
+    """Heuristic: did the model hedge or correct the false premise?"""
+    text = continuation(prompt, response).lower()
+    return any(marker in text for marker in CORRECTION_MARKERS)
+
+
+def is_degraded(prompt, response):
+    """Heuristic: has steering broken the output (repetition, fragments, gibberish)?"""
+    text = continuation(prompt, response)
+    words = re.findall(r"\w+", text.lower())
+    if len(words) < 8:
+        return True
+
+    distinct_ratio = len(set(words)) / len(words)
+    trigrams = list(zip(words, words[1:], words[2:]))
+    repeated_trigrams = 1 - len(set(trigrams)) / len(trigrams)
+    letters = sum(c.isalpha() or c.isspace() for c in text) / len(text)
+    return distinct_ratio < 0.35 or repeated_trigrams > 0.3 or letters < 0.7
+
+
+@dataclass
+class Evaluation:
+    strength: float
+    corrected_rate: float
+    degraded_rate: float
+    rows: list = field(default_factory=list)
+
+
+class StrengthSearch:
+    """Bisects the strength axis of a SweepSpec, memoising every probed strength."""
+
+    def __init__(self, spec, judge=is_corrected, degraded=is_degraded,
+                 max_workers=MAX_WORKERS, requests_per_second=REQUESTS_PER_SECOND):
+        self.spec = spec
+        self.judge = judge
+        self.degraded = degraded
+        self.max_workers = max_workers
+        self.requests_per_second = requests_per_second
+        self.evaluations = {}
+        self.calls = 0
+
+    def evaluate(self, strength):
+        """Steer every prompt at `strength` and score the outputs."""
+        strength = round(strength, 2)
+        if strength in self.evaluations:
+            return self.evaluations[strength]
+
+        pairs = self.spec.feature_strengths(strength)
+        settings_str = ", ".join(f"{f.name}={s}" for f, s in pairs)
+        features_for_call = [(f.index, s, f.layer) for f, s in pairs]
+        results = steering_completion_many(
+            [(prompt, features_for_call) for prompt in self.spec.prompts],
+            max_workers=self.max_workers,
+            requests_per_second=self.requests_per_second,
+        )
+
+        corrected = degraded = scored = 0
+        rows = []
+        for prompt, result in zip(self.spec.prompts, results):
+            self.calls += 1
+            if isinstance(result, SteeringError):
+                print(f"      ERROR: {result}")
+                continue
+            steered, default = result
+            clean_result = steered.replace("\n", " ").replace("\r", "")
+            scored += 1
+            corrected += self.judge(prompt, clean_result)
+            degraded += self.degraded(prompt, clean_result)
+            rows.append({
+                "prompt": prompt,
+                "config_name": f"{self.spec.name} (search)",
+                "settings": settings_str,
+                "default_response": default.replace("\n", " ").replace("\r", ""),
+                "steered_response": clean_result,
+            })
+
+        evaluation = Evaluation(
+            strength,
+            corrected / scored if scored else 0.0,
+            degraded / scored if scored else 0.0,
+            rows,
+        )
+        print(f"   {settings_str}: corrected {evaluation.corrected_rate:.0%}, "
+              f"degraded {evaluation.degraded_rate:.0%}")
+        self.evaluations[strength] = evaluation
+        return evaluation
+
+    def bisect(self, predicate):
+        """Smallest strength in [min, max] where predicate(evaluation) holds, to within tolerance.
+
+        Assumes the predicate is monotone in strength. Returns None if it does
+        not hold even at max_strength. Endpoint probes are shared between
+        searches through the memo.
+        """
+        lo, hi = self.spec.min_strength, self.spec.max_strength
+        if not predicate(self.evaluate(hi)):
+            return None
+        if predicate(self.evaluate(lo)):
+            return lo
+        while hi - lo > self.spec.tolerance:
+            mid = (lo + hi) / 2
+            if predicate(self.evaluate(mid)):
+                hi = mid
+            else:
+                lo = mid
+        return round(hi, 2)
+
+    def run(self):
+        """Find the minimal effective strength and the degradation point."""
+        spec = self.spec
+        # Past the degradation point outputs stop matching the correction markers,
+        # so "corrected or broken" is the monotone predicate to bisect on.
+        effective = self.bisect(
+            lambda e: e.corrected_rate >= spec.effective_fraction or e.degraded_rate >= spec.degraded_fraction
+        )
+        breaking = self.bisect(lambda e: e.degraded_rate >= spec.degraded_fraction)
+        usable = (
+            effective is not None
+            and self.evaluations[round(effective, 2)].corrected_rate >= spec.effective_fraction
+            and (breaking is None or effective < breaking)
+        )
+        return {
+            "name": spec.name,
+            "min_effective_strength": effective if usable else None,
+            "degradation_strength": breaking,
+            "usable": usable,
+            "probed_strengths": sorted(self.evaluations),
+            "calls": self.calls,
+            "grid_calls": len(spec.prompts) * (int((spec.max_strength - spec.min_strength) / spec.tolerance) + 1),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bisect steering strength per feature combo.")
+    parser.add_argument("spec", help="JSON sweep spec (one spec or a list)")
+    args = parser.parse_args()
+
+    os.makedirs(RUN_DIR, exist_ok=True)
+    run_timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    csv_filename = f"{RUN_DIR}/search_run_{run_timestamp}.csv"
+
+    summaries = []
+    with open(csv_filename, mode="w", newline="", encoding="utf-8") as csv_file:
+        writer = csv.DictWriter(
+            csv_file, fieldnames=["prompt", "config_name", "settings", "default_response", "steered_response"]
+        )
+        writer.writeheader()
+
+        for spec in load_specs(args.spec):
+            print(f"\n>>> SEARCH: {spec.name} [{spec.min_strength}, {spec.max_strength}] "
+                  f"over {len(spec.prompts)} prompts")
+            search = StrengthSearch(spec)
+            summary = search.run()
+            for strength in sorted(search.evaluations):
+                writer.writerows(search.evaluations[strength].rows)
+            summaries.append(summary)
+
+            print(f"   Minimal effective strength: {summary['min_effective_strength']}")
+            print(f"   Degradation point: {summary['degradation_strength']}"
+                  f"{'' if summary['usable'] else ' (no usable window)'}")
+            print(f"   {summary['calls']} calls (a full grid at this tolerance is {summary['grid_calls']})")
+
+    with open(csv_filename.replace(".csv", ".json"), "w", encoding="utf-8") as f:
+        json.dump(summaries, f, indent=2)
+
+    print(f"\nDone! Search results saved to {csv_filename}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+"""
+Resumable sweep runner.
+
+Each completed (prompt, config) cell is written to the run CSV and to an
+append-only journal next to it (`<run>.csv.journal`). Both files are fsynced
+in batches. Resuming a run rebuilds the CSV from the journal (dropping any
+half-written rows from the crash, but keeping columns added to the CSV since,
+such as reviewer labels) and only runs the cells that are missing. A run CSV
+written before journaling existed has its rows copied into a new journal
+first, so resuming it never loses them.
+"""
+
+import csv
+import hashlib
+import json
+import os
+
+FSYNC_EVERY = 25  # completed cells per flush + fsync
+
+
+def cell_key(*parts):
+    """Stable identifier for a sweep cell, e.g. cell_key(prompt, config_name, settings)."""
+    return hashlib.sha1(json.dumps(parts, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+def journal_path(csv_path):
+    return f"{csv_path}.journal"
+
+
+class SweepJournal:
+    """Append-only JSON-lines record of completed cells: {"key": ..., "row": {...}}."""
+
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+
+    def load(self):
+        """Return {key: row} for every complete entry, in the order they were written.
+
+        A torn final line (from a crash mid-write) is truncated away so new
+        entries append cleanly.
+        """
+        done = {}
+        if not os.path.exists(self.path):
+            return done
+
+        with open(self.path, "rb+") as f:
+            data = f.read()
+            end = data.rfind(b"\n") + 1
+            if end < len(data):
+                f.truncate(end)
+
+        for line in data[:end].splitlines():
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            done[entry["key"]] = entry["row"]
+        return done
+
+    def open(self, resume):
+        self.file = open(self.path, "a" if resume else "w", encoding="utf-8")
+        return self
+
+    def append(self, key, row):
+        self.file.write(json.dumps({"key": key, "row": row}, ensure_ascii=False) + "\n")
+
+    def sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        if self.file is not None:
+            self.sync()
+            self.file.close()
+            self.file = None
+
+
+def _sync(f):
+    f.flush()
+    os.fsync(f.fileno())
+
+
+def _extra_columns(csv_path, fieldnames):
+    """Columns of an existing run CSV beyond `fieldnames` (e.g. a compacted `corrected`).
+
+    Returns (extra field names, {sweep field values: [extra values per matching row]}),
+    so the values can be put back on the same rows when the CSV is rebuilt.
+    """
+    if not os.path.exists(csv_path):
+        return [], {}
+    with open(csv_path, newline="", encoding="utf-8") as csv_file:
+        reader = csv.DictReader(csv_file)
+        extra = [name for name in reader.fieldnames or [] if name not in fieldnames]
+        values = {}
+        if extra:
+            for row in reader:
+                key = tuple(row.get(name) or "" for name in fieldnames)
+                values.setdefault(key, []).append({name: row.get(name) or "" for name in extra})
+    return extra, values
+
+
+def _seed_journal(journal, csv_path, fieldnames, row_key):
+    """Journal the rows of a run CSV that has no journal yet (a run from before journaling)."""
+    with open(csv_path, newline="", encoding="utf-8") as csv_file:
+        rows = [{name: row.get(name) or "" for name in fieldnames} for row in csv.DictReader(csv_file)]
+    journal.open(resume=True)
+    try:
+        for row in rows:
+            journal.append(row_key(row), row)
+    finally:
+        journal.close()
+    return len(rows)
+
+
+def run_sweep(cells, run_cells, csv_path, fieldnames, resume=False, fsync_every=FSYNC_EVERY, row_key=None):
+    """Run every cell not already journaled for `csv_path` and append its row.
+
+    cells: list of (key, cell) pairs in output order.
+    run_cells: called with the list of pending cells and the rows already
+        completed; yields one row dict per pending cell in order, or None for a
+        cell that failed (it stays pending and is retried on the next resume).
+    row_key: maps a CSV row back to its cell key. Needed only to resume a run
+        CSV that has no journal; without it such a resume raises ValueError
+        rather than touching the CSV.
+
+    Returns a dict with counts of completed, skipped and failed cells.
+    """
+    journal = SweepJournal(journal_path(csv_path))
+    if resume and os.path.exists(csv_path) and not os.path.exists(journal.path):
+        if row_key is None:
+            raise ValueError(f"Cannot resume {csv_path}: it has no journal ({journal.path}) "
+                             f"and no row_key to rebuild one from its rows")
+        _seed_journal(journal, csv_path, fieldnames, row_key)
+    done = journal.load() if resume else {}
+
+    # Rebuild the CSV from the journal so it holds exactly the journaled rows,
+    # keeping columns added to it since (they are not in the journal)
+    sweep_fields = list(fieldnames)
+    extra, extra_values = _extra_columns(csv_path, sweep_fields) if resume else ([], {})
+    fieldnames = sweep_fields + extra
+    with open(csv_path, mode="w", newline="", encoding="utf-8") as csv_file:
+        writer = csv.DictWriter(csv_file, fieldnames=fieldnames, restval="")
+        writer.writeheader()
+        for row in done.values():
+            matches = extra_values.get(tuple(str(row.get(name) or "") for name in sweep_fields))
+            writer.writerow({**row, **matches.pop(0)} if matches else row)
+
+    pending = [(key, cell) for key, cell in cells if key not in done]
+    counts = {"completed": 0, "skipped": len(cells) - len(pending), "failed": 0}
+    if not pending:
+        return counts
+
+    journal.open(resume)
+    try:
+        with open(csv_path, mode="a", newline="", encoding="utf-8") as csv_file:
+            writer = csv.DictWriter(csv_file, fieldnames=fieldnames, restval="")
+            rows = run_cells([cell for _, cell in pending], list(done.values()))
+            for (key, _), row in zip(pending, rows):
+                if row is None:
+                    counts["failed"] += 1
+                    continue
+
+                writer.writerow(row)
+                journal.append(key, row)
+                counts["completed"] += 1
+
+                # CSV before journal: a cell is only marked done once its row is durable
+                if counts["completed"] % fsync_every == 0:
+                    _sync(csv_file)
+                    journal.sync()
+            _sync(csv_file)
+    finally:
+        journal.close()
+    return counts
@@ -1,19 +1,15 @@
 import os
-import csv
-import time
+import argparse
+from functools import partial
 from datetime import datetime
-from neuronpedia import steering_completion
+from neuronpedia import MAX_WORKERS, REQUESTS_PER_SECOND, SteeringError, get_response_cache, steering_completion_many
 from prompts import confabulation_prompts
+from sweep import cell_key, run_sweep
 
 # --- CONFIGURATION ---
-RUN_TIMESTAMP = datetime.now().strftime("%Y%m%d_%H%M%S")
 RUN_DIR = f"runs/stress_test"
 LOG_DIR = f"logs/stress_test"
-
-os.makedirs(RUN_DIR, exist_ok=True)
-os.makedirs(LOG_DIR, exist_ok=True)
-
-CSV_FILENAME = f"{RUN_DIR}/stress_run_{RUN_TIMESTAMP}.csv"
+FIELDNAMES = ["prompt", "config_name", "settings", "default_response", "steered_response"]
 
 # Define Features
 # FEAT_UNCERTAINTY = {"index": 80216, "layer": "9-gemmascope-res-131k", "name": "L9-Uncertainty"}
@@ -42,46 +38,114 @@ TEST_CASES = [
 # Prompts to stress test
 PROMPTS = confabulation_prompts["best_examples"]
 
-print(f"--- STARTING SYSTEMATIC STRESS TEST ---")
-print(f"Testing {len(PROMPTS)} prompts across {len(TEST_CASES)} configurations.")
-
-with open(CSV_FILENAME, mode='w', newline='', encoding='utf-8') as csv_file:
-    fieldnames = ["prompt", "config_name", "settings", "steered_response"]
-    writer = csv.DictWriter(csv_file, fieldnames=fieldnames)
-    writer.writeheader()
 
+def build_cells():
+    """Every (prompt, config) cell of the grid as (key, cell), in the order rows are written."""
+    cells = []
     for prompt in PROMPTS:
-        print(f"\n>>> PROMPT: {prompt}")
-        
         for case in TEST_CASES:
             # Construct settings string for record keeping
             settings_str = ", ".join([f"{f[0]['name']}={f[1]}" for f in case['features']])
-            print(f"   Testing: {case['name']} [{settings_str}]")
-            
-            try:
-                # We only need the steered response for stress testing usually
-                # Adjusting logic to unpack your function return correctly
-                features_for_call = [(f["index"], s, f["layer"]) for (f, s) in case["features"]]
-                steered, _ = steering_completion(prompt, features_for_call)
-                clean_result = steered.replace("\n", " ").replace("\r", "")
-                
-                writer.writerow({
-                    "prompt": prompt,
-                    "config_name": case['name'],
-                    "settings": settings_str,
-                    "steered_response": clean_result
-                })
-                print(f"      Result: {clean_result[:80]}...")
-                
-            except Exception as e:
-                print(f"      ERROR: {e}")
-                writer.writerow({
-                    "prompt": prompt,
-                    "config_name": case['name'],
-                    "settings": settings_str,
-                    "steered_response": f"ERROR: {e}"
-                })
-            
-            time.sleep(1)
-
-print(f"\nDone! Systematic results saved to {CSV_FILENAME}")
\ No newline at end of file
+            features_for_call = [(f["index"], s, f["layer"]) for (f, s) in case["features"]]
+            cells.append((
+                cell_key(prompt, case['name'], settings_str),
+                (prompt, case, settings_str, features_for_call),
+            ))
+    return cells
+
+
+def row_key(row):
+    """Cell key of a written CSV row (matches build_cells)."""
+    return cell_key(row["prompt"], row["config_name"], row["settings"])
+
+
+def run_cells(pending, done, local=False):
+    """Steer every pending cell, yielding its CSV row (None if the request failed).
+
+    The unsteered baseline depends only on the prompt, so the first one that
+    arrives is shared by every config of that prompt. It is asked for by every
+    cell of a prompt that has no baseline yet (in a completed row), so one
+    failed request cannot leave the prompt's other rows without it. The /steer
+    endpoint generates the default on every call anyway, and the local backend
+    generates it once per prompt per batch. With local=True the model is
+    steered in-process (local_steering) in batches instead of through the API.
+    """
+    baselines = {row["prompt"]: row["default_response"] for row in done if row.get("default_response")}
+
+    jobs = [
+        (prompt, features_for_call, prompt not in baselines)
+        for prompt, _, _, features_for_call in pending
+    ]
+
+    if local:
+        import local_steering
+        results = local_steering.steering_completion_many(jobs)
+    else:
+        results = steering_completion_many(
+            jobs,
+            max_workers=MAX_WORKERS,
+            requests_per_second=REQUESTS_PER_SECOND,
+        )
+
+    last_prompt = None
+    for (prompt, case, settings_str, _), result in zip(pending, results):
+        if prompt != last_prompt:
+            print(f"\n>>> PROMPT: {prompt}")
+            last_prompt = prompt
+        print(f"   Testing: {case['name']} [{settings_str}]")
+
+        # Failed cells are reported, not written, so the CSV only holds real responses
+        if isinstance(result, SteeringError):
+            print(f"      ERROR (after {result.attempts} attempts): {result}")
+            yield None
+            continue
+
+        steered, default = result
+        if default is not None:
+            baselines.setdefault(prompt, default.replace("\n", " ").replace("\r", ""))
+        clean_result = steered.replace("\n", " ").replace("\r", "")
+        print(f"      Result: {clean_result[:80]}...")
+        yield {
+            "prompt": prompt,
+            "config_name": case['name'],
+            "settings": settings_str,
+            "default_response": baselines.get(prompt, ""),
+            "steered_response": clean_result
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stress test steering configs across prompts.")
+    parser.add_argument("--resume", metavar="RUN_CSV",
+                        help="continue an interrupted run, skipping cells already in its journal")
+    parser.add_argument("--local", action="store_true",
+                        help="steer the model in-process in batches instead of calling the API")
+    args = parser.parse_args()
+
+    os.makedirs(RUN_DIR, exist_ok=True)
+    os.makedirs(LOG_DIR, exist_ok=True)
+
+    run_timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    csv_filename = args.resume or f"{RUN_DIR}/stress_run_{run_timestamp}.csv"
+
+    print(f"--- STARTING SYSTEMATIC STRESS TEST ---")
+    print(f"Testing {len(PROMPTS)} prompts across {len(TEST_CASES)} configurations.")
+
+    cells = build_cells()
+    counts = run_sweep(cells, partial(run_cells, local=args.local), csv_filename, FIELDNAMES,
+                       resume=bool(args.resume), row_key=row_key)
+    if counts["skipped"]:
+        print(f"\nResumed: skipped {counts['skipped']} cells already completed.")
+    if counts["failed"]:
+        print(f"\n{counts['failed']} of {len(cells)} cells failed and were not written; "
+              f"rerun with --resume {csv_filename} to retry them.")
+
+    cache = get_response_cache()
+    if cache:
+        print(f"\nResponse cache: {cache.stats()}")
+
+    print(f"\nDone! Systematic results saved to {csv_filename}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""
+LocalBackend on CPU with a tiny random Gemma-2 and a synthetic SAE decoder.
+"""
+
+import pytest
+import torch
+from tokenizers import Tokenizer, decoders, models, pre_tokenizers
+from transformers import DynamicCache, Gemma2Config, Gemma2ForCausalLM, PreTrainedTokenizerFast
+
+from local_steering import FREQ_PENALTY, FrequencyPenalty, LocalBackend, PrefixCache, generate_steered, steering_hooks
+
+HIDDEN = 64
+N_FEATURES = 32
+WORDS = ["<pad>", "<bos>", "<eos>", "<unk>"] + [f"w{i}" for i in range(124)]
+GREEDY = {"n_tokens": 8, "temperature": 0}
+SAMPLED = {"n_tokens": 8, "temperature": 0.8}
+
+
+class SyntheticSAE:
+    """Just the decoder LocalBackend reads: a random [features, hidden] W_dec per layer."""
+
+    def __init__(self, layer):
+        self.W_dec = torch.randn(N_FEATURES, HIDDEN, generator=torch.Generator().manual_seed(layer))
+
+
+@pytest.fixture(scope="module")
+def backend():
+    torch.manual_seed(0)
+    word_level = Tokenizer(models.WordLevel({w: i for i, w in enumerate(WORDS)}, unk_token="<unk>"))
+    word_level.pre_tokenizer = pre_tokenizers.WhitespaceSplit()
+    word_level.decoder = decoders.WordPiece(prefix="##")
+    tokenizer = PreTrainedTokenizerFast(
+        tokenizer_object=word_level, pad_token="<pad>", bos_token="<bos>", eos_token="<eos>", unk_token="<unk>"
+    )
+    config = Gemma2Config(
+        vocab_size=len(WORDS),
+        hidden_size=HIDDEN,
+        intermediate_size=128,
+        num_hidden_layers=2,
+        num_attention_heads=4,
+        num_key_value_heads=2,
+        head_dim=16,
+        sliding_window=8,
+        max_position_embeddings=256,
+        pad_token_id=0,
+        bos_token_id=1,
+        eos_token_id=2,
+    )
+    model = Gemma2ForCausalLM(config).eval()
+    return LocalBackend(model, tokenizer, sae_loader=lambda layer, width: SyntheticSAE(layer))
+
+
+LONG_PROMPT = "w1 w2 w3 w4 w5 w6 w7 w8 w9 w10"
+SHORT_PROMPT = "w11 w12 w13"
+FEATURES = [(3, 8.0, "0-gemmascope-res-131k"), (5, 4.0, "1-gemmascope-res-131k")]
+
+
+def test_batched_generation_matches_per_prompt(backend):
+    # Prompts of different lengths (left padding), per-row vectors, shared and skipped defaults
+    jobs = [
+        (LONG_PROMPT, FEATURES),
+        (SHORT_PROMPT, FEATURES, False),
+        (LONG_PROMPT, [(1, 6.0, "1-gemmascope-res-131k")]),
+        (SHORT_PROMPT, [], True),
+    ]
+    batched = list(backend.completions(jobs, batch_size=8, **GREEDY))
+    single = [next(backend.completions([job], **GREEDY)) for job in jobs]
+    assert batched == single
+    assert batched[1][1] is None
+
+
+def test_sampled_row_does_not_depend_on_batch(backend):
+    # A cell samples the same text alone, batched with other jobs, or at another row
+    jobs = [
+        (SHORT_PROMPT, FEATURES),
+        (LONG_PROMPT, [(1, 6.0, "1-gemmascope-res-131k")]),
+        (LONG_PROMPT, FEATURES),
+    ]
+    single = [next(backend.completions([job], **SAMPLED)) for job in jobs]
+    assert list(backend.completions(jobs, batch_size=8, **SAMPLED)) == single
+    assert list(backend.completions(jobs[::-1], batch_size=8, **SAMPLED)) == single[::-1]
+    assert single != [next(backend.completions([job], **GREEDY)) for job in jobs]
+
+
+def test_steering_changes_output(backend):
+    steered, default = next(backend.completions([(SHORT_PROMPT, [(3, 50.0, "0-gemmascope-res-131k")])], **GREEDY))
+    assert steered.startswith(SHORT_PROMPT) and default.startswith(SHORT_PROMPT)
+    assert steered != default
+
+    unsteered, _ = next(backend.completions([(SHORT_PROMPT, [])], **GREEDY))
+    assert unsteered == default
+
+
+# Longer than the sliding window (8), so the prefix KV of the sliding layers is truncated
+CHAT_PROMPT = " ".join(f"w{i}" for i in range(20, 44))
+
+
+def generate_after_unsteered_prefix(model, input_ids, additions):
+    """Reference for steer_prompt=False without a PrefixCache: prefill unsteered, then steer."""
+    past = DynamicCache(config=model.config)
+    with torch.no_grad():
+        model.model(input_ids=input_ids[:, :-1], past_key_values=past, use_cache=True)
+        with steering_hooks(model, additions):
+            output = model.generate(
+                input_ids=input_ids,
+                attention_mask=torch.ones_like(input_ids),
+                past_key_values=past,
+                max_new_tokens=GREEDY["n_tokens"],
+                do_sample=False,
+                logits_processor=[FrequencyPenalty(FREQ_PENALTY, input_ids.shape[1])],
+                pad_token_id=model.config.pad_token_id,
+            )
+    return output[0, input_ids.shape[1]:]
+
+
+@pytest.mark.parametrize("steer_prompt", [True, False])
+def test_prefix_cache_matches_uncached_generation(backend, steer_prompt):
+    # The cache replays private transformers state (layer forwards, cache layout), so
+    # check it end to end: generation with it must match generation without it
+    model = backend.model
+    input_ids = backend.tokenizer(CHAT_PROMPT, return_tensors="pt")["input_ids"]
+    assert input_ids.shape[1] > model.config.sliding_window
+    prefix_cache = PrefixCache(model)
+    # Steering only layer 1 replays layer 0 from the cache; steering layer 0 recomputes all
+    variants = [{}, backend.feature_additions([(1, 6.0, "1-gemmascope-res-131k")]), backend.feature_additions(FEATURES)]
+    for additions in variants:
+        cached = generate_steered(model, input_ids, additions, prefix_cache, steer_prompt, **GREEDY)
+        if steer_prompt:
+            uncached = generate_steered(model, input_ids, additions, **GREEDY)
+        else:
+            uncached = generate_after_unsteered_prefix(model, input_ids, additions)
+        assert torch.equal(cached, uncached)
+    assert (prefix_cache.misses, prefix_cache.hits) == (1, len(variants) - 1)
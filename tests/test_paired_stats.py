@@ -0,0 +1,47 @@
+"""
+PairedDifference streamed over batches against scipy's paired t-test on all the data at once.
+"""
+
+import numpy as np
+import pytest
+import torch
+from scipy import stats
+
+from paired_stats import PairedDifference
+
+N_FEATURES = 12
+
+
+def test_streamed_batches_match_ttest_rel():
+    generator = torch.Generator().manual_seed(0)
+    a = torch.randn(103, N_FEATURES, generator=generator) + torch.linspace(-1, 1, N_FEATURES)
+    b = 0.5 * a + torch.randn(103, N_FEATURES, generator=generator)
+
+    paired = PairedDifference(N_FEATURES)
+    # Uneven batches, including an empty one and a single pair
+    for start, end in [(0, 1), (1, 1), (1, 40), (40, 41), (41, 103)]:
+        paired.update(a[start:end], b[start:end])
+    result = paired.result()
+
+    a64, b64 = a.double().numpy(), b.double().numpy()
+    expected = stats.ttest_rel(a64, b64, axis=0)
+    np.testing.assert_allclose(result["t"], expected.statistic, rtol=1e-10)
+    np.testing.assert_allclose(result["p"], expected.pvalue, rtol=1e-8)
+    np.testing.assert_allclose(result["mean_a"], a64.mean(axis=0), rtol=1e-12)
+    np.testing.assert_allclose(result["mean_b"], b64.mean(axis=0), rtol=1e-12)
+    np.testing.assert_allclose(result["std_diff"], (a64 - b64).std(axis=0, ddof=1), rtol=1e-10)
+    assert [row["feature"] for row in paired.top(3)] == list(np.argsort(-np.abs(expected.statistic))[:3])
+
+
+def test_constant_differences():
+    a = torch.zeros(5, 3)
+    b = torch.tensor([0.0, 1.0, 0.0]).expand(5, 3)
+    paired = PairedDifference(3)
+    paired.update(a, b)
+    result = paired.result()
+    # No difference: t = 0, p = 1; a constant nonzero difference is infinitely significant
+    assert result["t"][0] == 0 and result["p"][0] == 1
+    assert result["t"][1] == -np.inf and result["p"][1] == 0
+
+    with pytest.raises(ValueError):
+        PairedDifference(3).result()
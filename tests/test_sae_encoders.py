@@ -0,0 +1,114 @@
+"""
+SAE encoders against sae_lens' own encode, on a small random JumpReLU SAE.
+"""
+
+from functools import lru_cache
+
+import pytest
+import torch
+from sae_lens import JumpReLUSAE, JumpReLUSAEConfig
+
+import models
+from sae_encoders import FeatureSubsetEncoder, SparseEncoder
+
+D_IN = 16
+D_SAE = 96
+
+
+@pytest.fixture(scope="module")
+def sae():
+    generator = torch.Generator().manual_seed(0)
+    sae = JumpReLUSAE(JumpReLUSAEConfig(d_in=D_IN, d_sae=D_SAE, apply_b_dec_to_input=True))
+    with torch.no_grad():
+        # Nonzero biases and thresholds, so every term of the encode matters
+        for name, scale in [("W_enc", 0.5), ("b_enc", 0.2), ("b_dec", 0.2), ("W_dec", 0.5)]:
+            param = getattr(sae, name)
+            param.copy_(scale * torch.randn(param.shape, generator=generator))
+        sae.threshold.copy_(0.5 * torch.rand(D_SAE, generator=generator))
+    return sae.eval()
+
+
+@pytest.fixture(scope="module")
+def residuals():
+    return 2 * torch.randn(40, D_IN, generator=torch.Generator().manual_seed(1))
+
+
+def test_subset_encoder_matches_full_encode(sae, residuals):
+    features = [90, 3, 17, 3, 0, 64]
+    with torch.no_grad():
+        full = sae.encode(residuals)
+    subset = FeatureSubsetEncoder(sae, features).encode(residuals)
+    assert subset.shape == (len(residuals), len(features))
+    assert (full[:, features] > 0).any() and (full[:, features] == 0).any()
+    torch.testing.assert_close(subset, full[:, features], rtol=0, atol=1e-6)
+
+    # Leading dimensions pass through, as for SAE.encode
+    batched = FeatureSubsetEncoder(sae, features).encode(residuals.view(4, 10, D_IN))
+    torch.testing.assert_close(batched.view(-1, len(features)), subset, rtol=0, atol=1e-6)
+
+
+@pytest.fixture
+def sae_weights(sae, tmp_path, monkeypatch):
+    """get_sae_weights(dtype, encode_only) converting the synthetic SAE into tmp_path."""
+    monkeypatch.setattr(models, "SAE_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(models, "get_sae", lru_cache(maxsize=None)(lambda layer, width, release: sae))
+    models.get_sae_weights.cache_clear()
+    yield lambda dtype="float32", encode_only=True: models.get_sae_weights(
+        0, "test", release="synthetic", dtype=dtype, encode_only=encode_only
+    )
+    models.get_sae_weights.cache_clear()
+
+
+def test_sae_weights_encode_matches_sae(sae, sae_weights, residuals):
+    with torch.no_grad():
+        expected = sae.encode(residuals)
+    weights = sae_weights()
+    assert weights.W_dec is None
+    assert weights.apply_b_dec_to_input
+    assert torch.equal(weights.encode(residuals), expected)
+    with pytest.raises(ValueError):
+        weights.decode(expected)
+
+    full = sae_weights(encode_only=False)
+    with torch.no_grad():
+        torch.testing.assert_close(full.decode(expected), sae.decode(expected))
+
+    # bf16 weights round each parameter, so only agree to bf16 precision, and a
+    # pre-activation within rounding of its threshold may gate either way
+    half = sae_weights("bfloat16")
+    assert half.W_enc.dtype == torch.bfloat16
+    with torch.no_grad():
+        hidden_pre = (residuals - sae.b_dec) @ sae.W_enc + sae.b_enc
+    clear = (hidden_pre - sae.threshold).abs() > 0.1
+    torch.testing.assert_close(half.encode(residuals).float()[clear], expected[clear], rtol=0.02, atol=0.05)
+
+
+@pytest.mark.parametrize("top_k", [None, 5])
+def test_sparse_encoder_matches_dense_encode(sae, residuals, top_k):
+    with torch.no_grad():
+        dense = sae.encode(residuals)
+    if top_k is not None:
+        top = dense.topk(top_k, dim=-1)
+        dense = torch.zeros_like(dense).scatter_(-1, top.indices, top.values)
+
+    # A scratch budget of a few tokens, so the encode runs over several chunks
+    encoder = SparseEncoder(sae, top_k=top_k, max_bytes=7 * 3 * 4 * D_SAE)
+    assert encoder.chunk_tokens == 7
+    encoded = encoder.encode(residuals)
+    assert encoded.layout == torch.sparse_csr
+    with torch.sparse.check_sparse_tensor_invariants():
+        torch.sparse_csr_tensor(encoded.crow_indices(), encoded.col_indices(), encoded.values(), encoded.shape)
+    assert encoded.values().gt(0).all()
+    torch.testing.assert_close(encoded.to_dense(), dense, rtol=0, atol=0)
+    torch.testing.assert_close(encoder.max_pool(residuals), dense.max(dim=0).values, rtol=0, atol=0)
+
+
+def test_sparse_encoder_caps_output(sae, residuals):
+    nnz = int((SparseEncoder(sae).encode(residuals).values() > 0).sum())
+    with pytest.raises(ValueError, match="max_output_bytes"):
+        SparseEncoder(sae, max_output_bytes=12 * (nnz - 1)).encode(residuals)
+    assert SparseEncoder(sae, max_output_bytes=12 * nnz).encode(residuals).values().numel() == nnz
+    # With top_k the output is at most k activations per token
+    cap = 12 * 2 * len(residuals)
+    assert cap < 12 * nnz
+    assert SparseEncoder(sae, top_k=2, max_output_bytes=cap).encode(residuals).values().numel() <= 2 * len(residuals)